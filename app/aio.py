@@ -0,0 +1,294 @@
+'''asyncio version of the join/start/commands flow, so that one process can
+play many games at once, both sides of each, without a thread per game.
+
+    python app/aio.py <server_url> [n_games]
+
+creates `n_games` games on the server and plays both sides of all of them
+concurrently. The HTTP client is a small keep-alive HTTP/1.1 client on top of
+`asyncio.open_connection`, since `requests` blocks.
+'''
+import asyncio
+import contextlib
+import functools as fnt
+import ssl
+import sys
+import time
+import typing as t
+import urllib.parse
+
+import requests
+
+try:
+    from app import main
+    from app import orbittable
+    from app import tickprofile
+except ImportError:
+    import main
+    import orbittable
+    import tickprofile
+
+
+class AsyncTransport:
+    '''Keep-alive HTTP/1.1 transport for one server, the asyncio counterpart of
+    `main.Transport`. Idle connections are kept in a pool and reused by
+    whichever request comes next; concurrent requests open more connections.
+    '''
+
+    def __init__(self, server_url, api_key=None, pool_maxsize=64):
+        url = urllib.parse.urlsplit(main._request_url(server_url, api_key))
+        self.host = url.hostname
+        self.ssl = ssl.create_default_context() if url.scheme == 'https' else None
+        self.port = url.port or (443 if self.ssl else 80)
+        self.target = url.path + (f'?{url.query}' if url.query else '')
+        self.pool_maxsize = pool_maxsize
+        host_header = url.netloc.rsplit('@', 1)[-1]
+        self._request_head = ('POST {target} HTTP/1.1\r\n'
+                              'Host: {host}\r\n'
+                              'Content-Type: text/plain\r\n'
+                              'Connection: keep-alive\r\n'
+                              'Content-Length: ').format(target=self.target,
+                                                         host=host_header).encode('ascii')
+        self._idle = []
+        self.n_requests = 0
+        self.n_connections_opened = 0
+
+    async def post(self, data: bytes) -> bytes:
+        '''Returns the response body. Raises `requests.HTTPError` for error statuses.
+        A reused connection that the server closed meanwhile is retried once on a new one.
+        '''
+        while True:
+            reused = bool(self._idle)
+            if reused:
+                reader, writer = self._idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+                self.n_connections_opened += 1
+
+            try:
+                writer.write(self._request_head + b'%d\r\n\r\n' % len(data) + data)
+                await writer.drain()
+                status, reason, body, keep_alive = await _read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            break
+
+        self.n_requests += 1
+        if keep_alive and len(self._idle) < self.pool_maxsize:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+        if status >= 400:
+            raise requests.HTTPError(f'{status} {reason} for url: {self.target}')
+        return body
+
+    def stats(self) -> dict:
+        '''Same as `main.Transport.stats`.'''
+        return {'n_requests': self.n_requests,
+                'n_connections_opened': self.n_connections_opened,
+                'n_connections_reused': self.n_requests - self.n_connections_opened}
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def _read_response(reader: asyncio.StreamReader) -> (int, str, bytes, bool):
+    '''Reads one response. Returns status, reason, body and whether the
+    connection can be used for another request.
+    '''
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('Connection closed before the response')
+    version, status, *reason = status_line.decode('latin-1').split(None, 2)
+    status = int(status)
+    reason = reason[0].strip() if reason else ''
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n'):
+            break
+        if not line:
+            raise asyncio.IncompleteReadError(b'', None)
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+
+    connection = headers.get('connection', '')
+    keep_alive = (connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive')
+
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0], 16)
+            if size == 0:
+                # Skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    return status, reason, body, keep_alive
+
+
+async def send_dsl(val: main.DSL, transport: AsyncTransport, decode_f=None,
+                   profiler: tickprofile.TickProfiler = None):
+    '''Async `main.send_dsl`. Use with `functools.partial(send_dsl, transport=...)`
+    as the `sender_f` of the functions below.
+    '''
+    start_time = time.perf_counter()
+    bit_str = main.make_request_body(val)
+    encoded_time = time.perf_counter()
+    main._log_debug('sending request',
+                    lambda: {'dsl': val,
+                             'bit_str': bit_str})
+    sent_time = time.perf_counter()
+    body = (await transport.post(bit_str.encode())).decode()
+    received_time = time.perf_counter()
+
+    if decode_f is None:
+        decode_f = main.parse_response_body
+    resp_val = decode_f(body)
+    decoded_time = time.perf_counter()
+    main._log_debug('response decoded',
+                    lambda: {'body': body,
+                             'val': resp_val})
+
+    if profiler is not None:
+        profiler.add('encode', encoded_time - start_time)
+        # Includes waiting for the event loop, which is busy with other games too
+        profiler.add('network', received_time - sent_time)
+        profiler.add('decode', decoded_time - received_time)
+        profiler.add('request_bits', len(bit_str))
+        profiler.add('response_bits', len(body))
+    return resp_val
+
+
+async def send_create(sender_f):
+    return main._parse_create_response(await sender_f(main._create_request_dsl()))
+
+
+async def send_join(player_key, sender_f):
+    return main._parse_game_response(await sender_f(main._join_request_dsl(player_key),
+                                                    decode_f=main.decode_game_response))
+
+
+async def send_start(player_key, x0, x1, x2, x3, sender_f):
+    return main._parse_game_response(await sender_f(main._start_request_dsl(player_key, x0, x1, x2, x3),
+                                                    decode_f=main.decode_game_response))
+
+
+async def send_commands(player_key, commands, sender_f, profiler: tickprofile.TickProfiler = None):
+    if profiler is None:
+        return main._parse_game_response(await sender_f(main._commands_request_template(player_key, commands),
+                                                        decode_f=main.decode_game_response))
+
+    with profiler.phase('encode'):
+        request = main._commands_request_template(player_key, commands)
+    resp = await sender_f(request, decode_f=main.decode_game_response)
+    with profiler.phase('parse'):
+        return main._parse_game_response(resp)
+
+
+async def play_game(player_key, sender_f, rng=None, ship_params=main.START_SHIP_PARAMS,
+                    max_n_rounds=main.MAX_N_ROUNDS,
+                    planning_budget=None,
+                    profiler: tickprofile.TickProfiler = None,
+                    orbit_table: orbittable.OrbitTable = None,
+                    planning_pool: 'main._PlanningPool' = None) -> main.GameResponse:
+    '''Plays one side of a game like `main.main` does, until the game is
+    finished or `max_n_rounds` commands were sent. Returns the last response.
+    Each tick is planned by `main._plan_tick`, with the `orbit_table` and
+    `planning_pool` if given. Planning runs in the event loop, so with many games
+    it also holds up the others; `planning_budget` bounds that like it bounds a
+    tick in `main.main`, and is `BOT_TICK_BUDGET_SECONDS` by default too.
+    With a `profiler`, `sender_f` has to take it too, like `send_dsl`.
+    '''
+    if rng is None:
+        rng = main._make_rng()
+    if planning_budget is None:
+        planning_budget = main._tick_planning_budget()
+    if profiler is not None:
+        sender_f = fnt.partial(sender_f, profiler=profiler)
+
+    join_game_resp = await send_join(player_key, sender_f=sender_f)
+    our_role = join_game_resp.role
+
+    game_resp = await send_start(player_key, *ship_params, sender_f=sender_f)
+    our_ship_id = main._extract_ship_ids(game_resp).get(our_role)
+
+    shots_done_count = 0
+    if profiler is not None:
+        profiler.discard_tick()
+    for _ in range(max_n_rounds):
+        if (not game_resp.success or game_resp.game_stage == 'finished'
+                or game_resp.game_state is None):
+            break
+
+        cmds, shots_done_count, _ = main._plan_tick(game_resp.game_state, our_role, our_ship_id,
+                                                    rng, shots_done_count,
+                                                    planning_budget=planning_budget,
+                                                    orbit_table=orbit_table,
+                                                    planning_pool=planning_pool,
+                                                    profiler=profiler,
+                                                    log_data={'player_key': player_key})
+        n_ships = len(game_resp.game_state.ships_and_commands)
+        game_resp = await send_commands(player_key, cmds, sender_f=sender_f, profiler=profiler)
+        if profiler is not None:
+            profiler.end_tick(n_ships=n_ships)
+
+    return game_resp
+
+
+async def play_both_sides(sender_f, **play_game_kwargs) -> (main.GameResponse, main.GameResponse):
+    '''Creates a game and plays it as both the attacker and the defender.'''
+    attacker_key, defender_key = await send_create(sender_f)
+    return tuple(await asyncio.gather(play_game(attacker_key, sender_f, **play_game_kwargs),
+                                      play_game(defender_key, sender_f, **play_game_kwargs)))
+
+
+async def play_many_games(server_url, n_games, api_key=None,
+                          **play_game_kwargs) -> t.List[t.Tuple[main.GameResponse, main.GameResponse]]:
+    '''Plays both sides of `n_games` games concurrently over one transport.'''
+    async with AsyncTransport(server_url, api_key) as transport:
+        sender_f = fnt.partial(send_dsl, transport=transport)
+        results = await asyncio.gather(*[play_both_sides(sender_f, **play_game_kwargs)
+                                         for _ in range(n_games)])
+        main._log_info('transport stats', transport.stats())
+    return results
+
+
+if __name__ == '__main__':
+    server_url = sys.argv[1]
+    n_games = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    # The same tables and workers as `main.main`
+    with contextlib.ExitStack() as resources:
+        orbit_table = main._open_orbit_table()
+        if orbit_table is not None:
+            resources.enter_context(orbit_table)
+        planning_pool = main._open_planning_pool(orbit_table)
+        if planning_pool is not None:
+            resources.enter_context(planning_pool)
+        asyncio.run(play_many_games(server_url, n_games, orbit_table=orbit_table, planning_pool=planning_pool))
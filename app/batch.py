@@ -0,0 +1,286 @@
+'''Batch versions of `make_request_body` / `parse_response_body` for offline
+analysis of many recorded responses or candidate commands at once.
+
+The bit-level work (width prefixes, number bits) is done with NumPy over all
+values concatenated together. Walking the tokens and building the Python values
+is still a plain loop, but it no longer has to look at individual bits.
+'''
+import typing as t
+
+import numpy as np
+
+try:
+    from app import main
+except ImportError:
+    import main
+
+
+# Token kinds are the values of their two "type bits"
+_NIL, _POS, _NEG, _CONS = 0, 1, 2, 3
+
+# Numbers with more width bits than this don't fit in uint64
+_MAX_WIDTH = 16
+
+# `_NIBBLE_THRESHOLDS[k]` is the smallest number needing `k + 1` width bits
+_NIBBLE_THRESHOLDS = np.array([16 ** k for k in range(_MAX_WIDTH)], dtype=np.uint64)
+
+
+class _Unbatchable(Exception):
+    pass
+
+
+_UINT64_LIMIT = 2 ** 64
+
+
+def _flatten_tokens(val: main.DSL, kinds: t.List[int], abs_values: t.List[int]):
+    '''Appends the tokens of `val` in the same order as `main._modulate_into`.
+    Walks a stack of iterators so that flat lists of numbers, the common case,
+    don't need a push and pop per item.
+    Raises `_Unbatchable` for values that have to go through the scalar path.
+    '''
+    kinds_append = kinds.append
+    abs_values_append = abs_values.append
+    # (items, is_list): list items are each preceded by a cons and followed by nil
+    stack = [(iter((val,)), False)]
+    while stack:
+        items, is_list = stack[-1]
+        for item in items:
+            if is_list:
+                kinds_append(_CONS)
+                abs_values_append(0)
+
+            item_type = type(item)
+            if item_type is int or isinstance(item, int):
+                if item >= 0:
+                    kinds_append(_POS)
+                    abs_values_append(item)
+                else:
+                    kinds_append(_NEG)
+                    abs_values_append(-item)
+                if item >= _UINT64_LIMIT or item <= -_UINT64_LIMIT:
+                    raise _Unbatchable()
+
+            elif item is None:
+                kinds_append(_NIL)
+                abs_values_append(0)
+
+            elif item_type is list or isinstance(item, list):
+                stack.append((iter(item), True))
+                break
+
+            elif isinstance(item, main.Modulated):
+                raise _Unbatchable()
+
+            elif isinstance(item, main.Cons):
+                kinds_append(_CONS)
+                abs_values_append(0)
+                stack.append((iter(item), False))
+                break
+
+            else:
+                raise ValueError(f"Can't modulate value {item} of type {type(item)}")
+        else:
+            stack.pop()
+            if is_list:
+                kinds_append(_NIL)
+                abs_values_append(0)
+
+
+def _repeat_ranges(starts, lengths):
+    '''Concatenation of `range(start, start + length)` for each pair.'''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    range_starts = np.cumsum(lengths) - lengths
+    offsets = np.arange(total, dtype=np.int64) - np.repeat(range_starts, lengths)
+    return np.repeat(np.asarray(starts, dtype=np.int64), lengths) + offsets
+
+
+def make_request_bodies(vals: t.Sequence[main.DSL]) -> t.List[str]:
+    '''Same as `[make_request_body(val) for val in vals]`.'''
+    bodies = [None] * len(vals)
+    kinds = []
+    abs_values = []
+    batched = []
+    n_tokens = []
+    for i, val in enumerate(vals):
+        n_before = len(kinds)
+        try:
+            _flatten_tokens(val, kinds, abs_values)
+        except _Unbatchable:
+            del kinds[n_before:]
+            del abs_values[n_before:]
+            bodies[i] = main.make_request_body(val)
+            continue
+        batched.append(i)
+        n_tokens.append(len(kinds) - n_before)
+
+    if not kinds:
+        return bodies
+
+    kinds = np.array(kinds, dtype=np.uint8)
+    abs_values = np.array(abs_values, dtype=np.uint64)
+    is_number = (kinds == _POS) | (kinds == _NEG)
+    widths = np.where(is_number,
+                      np.searchsorted(_NIBBLE_THRESHOLDS, abs_values, side='right'),
+                      0)
+    lengths = np.where(is_number, 3 + 5 * widths, 2)
+    offsets = np.cumsum(lengths) - lengths
+
+    bits = np.zeros(int(lengths.sum()), dtype=np.uint8)
+    bits[offsets] = kinds >> 1
+    bits[offsets + 1] = kinds & 1
+    bits[_repeat_ranges(offsets + 2, widths)] = 1
+    for width in np.unique(widths[is_number]):
+        if width == 0:
+            continue
+        selected = is_number & (widths == width)
+        shifts = np.arange(4 * width - 1, -1, -1, dtype=np.uint64)
+        digits = (abs_values[selected][:, None] >> shifts) & np.uint64(1)
+        positions = (offsets[selected] + 3 + width)[:, None] + np.arange(4 * width)
+        bits[positions] = digits
+
+    text = (bits + ord('0')).tobytes().decode('ascii')
+    token_ends = np.cumsum(n_tokens)
+    bit_ends = np.append(offsets, len(bits))[token_ends].tolist()
+    bit_start = 0
+    for i, bit_end in zip(batched, bit_ends):
+        bodies[i] = text[bit_start:bit_end]
+        bit_start = bit_end
+    return bodies
+
+
+def _token_starts(types, token_lengths, start, end) -> t.Optional[t.List[int]]:
+    '''Positions of the tokens of the value starting at `start`,
+    or None if it doesn't fit before `end`.
+    '''
+    starts = []
+    pos = start
+    need = 1
+    while need:
+        if pos >= end - 1:
+            return None
+        starts.append(pos)
+        if types[pos] == _CONS:
+            need += 1
+        else:
+            need -= 1
+        pos += token_lengths[pos]
+
+    if pos > end:
+        return None
+    return starts
+
+
+def _build_dsl(kinds, values) -> main.DSL:
+    '''Builds the same value as `cons_tree_to_list` of the demodulated cons tree,
+    straight from the tokens and without making any `Cons` cells.
+    A cons in car position opens a nested list, a cons in cdr position continues
+    the current one, and an atom in cdr position closes it.
+    '''
+    if kinds[0] != _CONS:
+        return _atom(kinds[0], values[0])
+
+    root = []
+    open_lists = [root]
+    in_car = True
+    for kind, val in zip(kinds[1:], values[1:]):
+        if kind == _CONS:
+            if in_car:
+                nested = []
+                open_lists[-1].append(nested)
+                open_lists.append(nested)
+            in_car = True
+
+        elif in_car:
+            open_lists[-1].append(_atom(kind, val))
+            in_car = False
+
+        else:
+            if kind != _NIL:
+                open_lists[-1].append(_atom(kind, val))
+            open_lists.pop()
+
+    return root
+
+
+def _atom(kind, val):
+    if kind == _NIL:
+        return None
+    elif kind == _NEG:
+        return -val
+    else:
+        return val
+
+
+def parse_response_bodies(bodies: t.Sequence[t.Union[str, bytes]]) -> t.List[main.DSL]:
+    '''Same as `[parse_response_body(body) for body in bodies]`.'''
+    bodies = [main._bits_to_str(body) for body in bodies]
+    if not bodies:
+        return []
+
+    text = ''.join(bodies)
+    bits = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8) - ord('0')
+    if np.any(bits > 1):
+        # Let the scalar path report it
+        for body in bodies:
+            main.parse_response_body(body)
+
+    # Padding keeps lookahead past the last body in bounds and ends its last run of ones
+    padded = np.concatenate([bits, np.zeros(3, dtype=np.uint8)])
+    positions = np.arange(len(padded), dtype=np.int64)
+    next_zero = np.minimum.accumulate(np.where(padded == 0, positions, len(padded))[::-1])[::-1]
+    ones_runs = next_zero - positions
+    types = (padded[:-1] << 1) | padded[1:]
+    widths = np.zeros(len(padded), dtype=np.int64)
+    widths[:-2] = ones_runs[2:]
+    is_number = (types == _POS) | (types == _NEG)
+    token_lengths = np.where(is_number, 3 + 5 * widths[:-1], 2)
+
+    types_list = types.tolist()
+    token_lengths_list = token_lengths.tolist()
+    results = [None] * len(bodies)
+    batched = []
+    all_starts = []
+    start = 0
+    for i, body in enumerate(bodies):
+        end = start + len(body)
+        starts = _token_starts(types_list, token_lengths_list, start, end)
+        if starts is None:
+            results[i] = main.parse_response_body(body)
+        else:
+            batched.append((i, len(starts)))
+            all_starts.extend(starts)
+        start = end
+
+    all_starts = np.array(all_starts, dtype=np.int64)
+    token_types = types[all_starts]
+    token_widths = widths[all_starts]
+    token_is_number = is_number[all_starts]
+    values = np.zeros(len(all_starts), dtype=np.uint64)
+    big_values = {}
+    for width in np.unique(token_widths[token_is_number]):
+        if width == 0:
+            continue
+        selected = np.flatnonzero(token_is_number & (token_widths == width))
+        digit_starts = all_starts[selected] + 3 + width
+        if width > _MAX_WIDTH:
+            for token_i, digit_start in zip(selected.tolist(), digit_starts.tolist()):
+                big_values[token_i] = int(text[digit_start:digit_start + 4 * width], 2)
+            continue
+        digits = padded[digit_starts[:, None] + np.arange(4 * width)].astype(np.uint64)
+        shifts = np.arange(4 * width - 1, -1, -1, dtype=np.uint64)
+        values[selected] = (digits << shifts).sum(axis=1, dtype=np.uint64)
+
+    token_types = token_types.tolist()
+    values = values.tolist()
+    for token_i, value in big_values.items():
+        values[token_i] = value
+
+    token_start = 0
+    for i, n_tokens in batched:
+        token_end = token_start + n_tokens
+        results[i] = _build_dsl(token_types[token_start:token_end], values[token_start:token_end])
+        token_start = token_end
+    return results
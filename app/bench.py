@@ -0,0 +1,674 @@
+'''Benchmarks for the hot paths of the bot.
+
+Run with `python app/bench.py` from the repo root. Use `-k` to pick benchmarks
+by name, `--json` to save the results and `--compare` to compare them with
+results saved from another commit, e.g.
+
+    python app/bench.py --json before.json
+    git checkout <other commit>
+    python app/bench.py --compare before.json
+
+Recorded responses are read from `app/bench_responses/*.txt`, one response body
+per line. Single-ship and 64-ship forked fleet responses in the server's format
+are included; add more recordings there. Whole games recorded with
+`BOT_RECORD_PATH` or `simulator.record_game` are replayed from
+`app/bench_responses/*.rec`.
+'''
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import pprint
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+try:
+    from app import batch
+    from app import build_orbit_table
+    from app import collision
+    from app import fleets
+    from app import jsonlog
+    from app import main
+    from app import orbittable
+    from app import replay
+    from app import simulator
+except ImportError:
+    import batch
+    import build_orbit_table
+    import collision
+    import fleets
+    import jsonlog
+    import main
+    import orbittable
+    import replay
+    import simulator
+
+
+RESPONSES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_responses')
+
+
+def _time_call(f, *args, repeat=3, min_seconds=0.02):
+    '''Best-of-`repeat` wall time of a single `f(*args)` call, in seconds.
+    Each repeat makes enough calls to take at least `min_seconds`.
+    '''
+    timer = timeit.Timer(lambda: f(*args))
+    n_calls = 1
+    while True:
+        seconds = timer.timeit(number=n_calls)
+        if seconds >= min_seconds:
+            break
+        n_calls = max(n_calls * 2, int(n_calls * min_seconds / max(seconds, 1e-9)))
+    return min([seconds] + timer.repeat(repeat=repeat - 1, number=n_calls)) / n_calls
+
+
+def _allocated_bytes(f, *args):
+    '''Bytes held by the result of `f(*args)`, and peak bytes allocated while making it.'''
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = f(*args)
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before, peak - before
+
+
+def _report(results, benchmark, case, seconds, **extra):
+    '''Prints a result and appends it to `results`, the machine-readable output.'''
+    results.append(dict(benchmark=benchmark, case=case, seconds=seconds, **extra))
+    extras = ' '.join(f'{key}={val}' for key, val in extra.items())
+    print(f'{benchmark:24} {case:34} {seconds * 1e3:10.3f} ms  {extras}')
+
+
+def _fleet_dsl(n_ships):
+    '''Something shaped like the `ships_and_commands` part of a game state.'''
+    return [[[i % 2, i, main.Cons(48 - i, -48 + i), main.Cons(i % 7 - 3, 3 - i % 5),
+              [128 - i % 128, 0, 8, 1], 0, 64, 1],
+             [[0, main.Cons(1, -1)]]]
+            for i in range(n_ships)]
+
+
+def _game_response_dsl(n_ships, game_tick=42):
+    '''Something shaped like a `commands` response in the middle of a game.'''
+    return [1, 1, [256, 0, [512, 1, 64], [16, 128], [272, 16, 4, 32]],
+            [game_tick, [16, 128], _fleet_dsl(n_ships)]]
+
+
+def _recorded_responses():
+    '''`(name, body)` for every recorded response.'''
+    for path in sorted(glob.glob(os.path.join(RESPONSES_DIR, '*.txt'))):
+        name, _ = os.path.splitext(os.path.basename(path))
+        with open(path) as f:
+            bodies = [line.strip() for line in f if line.strip()]
+        for i, body in enumerate(bodies):
+            yield f'{name}[{i}]', body
+
+
+def _codec_cases(sizes):
+    '''`(case, body)` for synthetic game responses of growing size, then recorded ones.'''
+    for n_ships in sizes:
+        yield f'synthetic {n_ships} ships', main.make_request_body(_game_response_dsl(n_ships))
+    yield from _recorded_responses()
+
+
+def bench_codec(results, sizes=(1, 8, 64, 512)):
+    '''Every step of turning a response body into game records, and back.'''
+    for case, body in _codec_cases(sizes):
+        bits = [int(bit) for bit in body]
+        tree, _ = main.demodulate_bits(bits)
+        dsl = main.parse_response_body(body)
+        n_bits = len(body)
+        _report(results, 'modulate', case, _time_call(main.modulate, tree), n_bits=n_bits)
+        _report(results, 'demodulate_bits', case, _time_call(main.demodulate_bits, bits), n_bits=n_bits)
+        _report(results, 'make_request_body', case, _time_call(main.make_request_body, dsl), n_bits=n_bits)
+        _report(results, 'parse_response_body', case, _time_call(main.parse_response_body, body), n_bits=n_bits)
+        _report(results, '_parse_game_response', case, _time_call(main._parse_game_response, dsl), n_bits=n_bits)
+        _report(results, 'decode_game_response', case, _time_call(main.decode_game_response, body), n_bits=n_bits)
+
+
+def bench_decode_scaling(results, sizes=(16, 64, 256, 1024, 4096)):
+    '''Decode time per bit should stay flat as responses grow.'''
+    for n_ships in sizes:
+        body = main.make_request_body(_fleet_dsl(n_ships))
+        seconds = _time_call(main.parse_response_body, body)
+        _report(results, 'decode_scaling', f'{n_ships} ships', seconds,
+                n_bits=len(body), ns_per_bit=round(seconds / len(body) * 1e9, 1))
+
+
+def bench_encode_scaling(results, sizes=(16, 64, 256, 1024, 4096)):
+    for n_ships in sizes:
+        dsl = _fleet_dsl(n_ships)
+        seconds = _time_call(main.make_request_body, dsl)
+        n_bits = len(main.make_request_body(dsl))
+        _report(results, 'encode_scaling', f'{n_ships} ships', seconds,
+                n_bits=n_bits, ns_per_bit=round(seconds / n_bits * 1e9, 1))
+
+
+def _tick_commands_dsl(n_ships):
+    cmds = []
+    for ship_id in range(n_ships):
+        cmds.append(main._accelerate_command_dsl(ship_id, main._make_acc_vector(ship_id % 3 - 1, 1)))
+        cmds.append(main._shoot_command_dsl(ship_id, main.Cons(40 + ship_id, -ship_id), ship_id))
+    cmds.append(main._fork_command_dsl(0, 64, 0, 0, 1))
+    return main.make_request_body(main._commands_request_dsl(1113939892088752268, cmds))
+
+
+def _tick_commands_template(n_ships):
+    cmds = []
+    for ship_id in range(n_ships):
+        cmds.append(main._accelerate_command_template(ship_id, main._make_acc_vector(ship_id % 3 - 1, 1)))
+        cmds.append(main._shoot_command_template(ship_id, main.Cons(40 + ship_id, -ship_id), ship_id))
+    cmds.append(main._fork_command_template(0, 64, 0, 0, 1))
+    return main._commands_request_template(1113939892088752268, cmds).bits
+
+
+def bench_commands_request(results, sizes=(1, 8, 64, 256)):
+    '''Building a whole tick's commands request from DSL lists vs from templates.'''
+    for n_ships in sizes:
+        assert _tick_commands_dsl(n_ships) == _tick_commands_template(n_ships)
+        _report(results, 'commands_request_dsl', f'{n_ships} ships',
+                _time_call(_tick_commands_dsl, n_ships))
+        _report(results, 'commands_request_template', f'{n_ships} ships',
+                _time_call(_tick_commands_template, n_ships))
+
+
+def bench_batch_codec(results, n_values=1000, n_ships=8):
+    '''Scalar vs NumPy batch codec on many recorded-response-sized values.'''
+    dsls = [main.cons_tree_to_list(main._make_cons_tree(_fleet_dsl(n_ships))) for _ in range(n_values)]
+    bodies = batch.make_request_bodies(dsls)
+    case = f'{n_values} x {n_ships} ships'
+    _report(results, 'parse_scalar', case,
+            _time_call(lambda: [main.parse_response_body(body) for body in bodies]))
+    _report(results, 'parse_batch', case, _time_call(batch.parse_response_bodies, bodies))
+    _report(results, 'make_scalar', case,
+            _time_call(lambda: [main.make_request_body(dsl) for dsl in dsls]))
+    _report(results, 'make_batch', case, _time_call(batch.make_request_bodies, dsls))
+
+    # Distinct numbers miss the scalar number cache
+    rng = np.random.default_rng(42)
+    dsls = [[int(n) for n in rng.integers(-2 ** 40, 2 ** 40, size=64)] for _ in range(n_values)]
+    case = f'{n_values} x 64 random numbers'
+    _report(results, 'make_scalar', case,
+            _time_call(lambda: [main.make_request_body(dsl) for dsl in dsls]))
+    _report(results, 'make_batch', case, _time_call(batch.make_request_bodies, dsls))
+
+
+def bench_decoded_memory(results, sizes=(1, 50, 500)):
+    '''Memory held by decoded game states, and peak memory while decoding them.'''
+    for n_ships in sizes:
+        body = main.make_request_body(_game_response_dsl(n_ships))
+        case = f'{n_ships} ships'
+        for benchmark, f in [('memory_cons_tree', main.demodulate_bits),
+                             ('memory_dsl', main.parse_response_body),
+                             ('memory_game_records',
+                              lambda body: main._parse_game_response(main.parse_response_body(body))),
+                             ('memory_decode_game_response', main.decode_game_response)]:
+            held, peak = _allocated_bytes(f, body)
+            _report(results, benchmark, case, _time_call(f, body), held_bytes=held, peak_bytes=peak)
+
+
+def bench_simulated_games(results, seeds=(0, 1, 2)):
+    '''Whole games against the local simulator, both sides played by the bot.'''
+    for seed in seeds:
+        _, stats = simulator.play_local_game(seed)
+        _report(results, 'simulated_game', f'seed {seed}', stats['seconds'],
+                n_ticks=stats['n_ticks'],
+                ticks_per_second=round(stats['ticks_per_second']),
+                plan_us_per_tick=round(stats['plan_seconds'] / max(stats['n_ticks'], 1) * 1e6))
+
+
+def _pprint_log(msg, data=None):
+    '''How `main._log_info` used to log everything.'''
+    print(msg)
+    if data is not None:
+        pprint.pp(data)
+
+
+def _tick_log_records(n_ships):
+    '''What a tick of `main.main` logs: the commands request and the game response.'''
+    cmds = [main._accelerate_command_template(ship_id, main.Cons(1, -1)) for ship_id in range(n_ships)]
+    request_dsl = main._commands_request_template(1113939892088752268, cmds)
+    request_body = main.make_request_body(request_dsl)
+    response_body = main.make_request_body(_game_response_dsl(n_ships))
+    response = main.decode_game_response(response_body)
+    return cmds, request_dsl, request_body, response_body, response
+
+
+def _log_tick_pprint(cmds, request_dsl, request_body, response_body, response):
+    _pprint_log('sending commands', {'cmds': cmds})
+    _pprint_log('sending request', {'dsl': request_dsl, 'bit_str': request_body})
+    _pprint_log('response received', {'status_code': 200})
+    _pprint_log('response decoded', {'body': response_body, 'val': response})
+    _pprint_log('commands sent', {'cmd_resp': response})
+
+
+def _log_tick_jsonlog(logger, cmds, request_dsl, request_body, response_body, response):
+    logger.debug('sending commands', {'cmds': cmds})
+    logger.debug('sending request', lambda: {'dsl': request_dsl, 'bit_str': request_body})
+    logger.debug('response received', {'status_code': 200})
+    logger.debug('response decoded', lambda: {'body': response_body, 'val': response})
+    logger.debug('commands sent', {'cmd_resp': response})
+    logger.info('tick', {'round_i': 0,
+                         'game_stage': response.game_stage,
+                         'game_tick': response.game_state.game_tick,
+                         'n_cmds': len(cmds),
+                         'n_ships': len(response.game_state.ships_and_commands)})
+
+
+def bench_logging(results, sizes=(1, 64)):
+    '''Time spent logging one tick in the main loop, with the old pprint logging
+    and with `jsonlog` at each level. Output goes to memory, not a terminal.
+    '''
+    for n_ships in sizes:
+        records = _tick_log_records(n_ships)
+        case = f'{n_ships} ships'
+
+        def pprint_tick():
+            with contextlib.redirect_stdout(io.StringIO()):
+                _log_tick_pprint(*records)
+
+        _report(results, 'log_tick_pprint', case, _time_call(pprint_tick))
+        for level_name in ['debug', 'info', 'quiet']:
+            logger = jsonlog.Logger(io.StringIO(), level=jsonlog.LEVELS[level_name])
+            _report(results, f'log_tick_json_{level_name}', case,
+                    _time_call(_log_tick_jsonlog, logger, *records))
+
+        # Only the time spent in the tick; formatting happens in the writer thread
+        logger = jsonlog.Logger(io.StringIO(), level=jsonlog.DEBUG, background=True)
+        _report(results, 'log_tick_json_debug_bg', case,
+                _time_call(_log_tick_jsonlog, logger, *records))
+        logger.close()
+
+
+def bench_replay(results):
+    '''Replaying recorded games: decoding, parsing, planning and encoding every tick.'''
+    for path in sorted(glob.glob(os.path.join(RESPONSES_DIR, '*.rec'))):
+        name, _ = os.path.splitext(os.path.basename(path))
+        seconds = _time_call(replay.replay, path, repeat=3, min_seconds=0.1)
+        summary = replay.replay(path).summary()
+        _report(results, 'replay', name, seconds,
+                n_ticks=summary['n_ticks'],
+                us_per_tick=round(seconds / max(summary['n_ticks'], 1) * 1e6, 1))
+
+
+def bench_trajectories(results, sizes=(1, 8, 16, 64, 512)):
+    '''Predicting 20 steps and planet hits one ship at a time vs all at once,
+    for the current velocities and for all 9 accelerations.
+    '''
+    accelerations = main.ACCELERATIONS.tolist()
+
+    def scalar(positions, velocities):
+        return [main._trajectory_hits_planet(main._predicted_trajectory(position, velocity))
+                for position, velocity in zip(positions, velocities)]
+
+    def scalar_candidates(positions, velocities):
+        return [scalar([position] * len(accelerations),
+                       [[velocity[0] - acc_x, velocity[1] - acc_y] for acc_x, acc_y in accelerations])
+                for position, velocity in zip(positions, velocities)]
+
+    for n_ships in sizes:
+        positions, velocities = fleets.random_fleet(n_ships)
+        case = f'{n_ships} ships'
+        _report(results, 'trajectories_scalar', case, _time_call(scalar, positions, velocities))
+        _report(results, 'trajectories_batch', case,
+                _time_call(main._predicted_trajectories, positions, velocities))
+        _report(results, 'candidates_scalar', case, _time_call(scalar_candidates, positions, velocities))
+        _report(results, 'candidates_batch', case,
+                _time_call(main._candidate_trajectories, positions, velocities))
+
+
+def _coasting_ticks(n_ships, n_ticks):
+    '''`(positions, velocities)` of a fleet coasting for `n_ticks` ticks.'''
+    positions, velocities = fleets.random_fleet(n_ships, seed=1)
+    ticks = []
+    for _ in range(n_ticks):
+        ticks.append((positions, velocities))
+        velocities = [main._next_velocity(position, velocity) for position, velocity in zip(positions, velocities)]
+        positions = [main._next_position(position, velocity) for position, velocity in zip(positions, velocities)]
+    return ticks
+
+
+def bench_trajectory_cache(results, sizes=(8, 64), n_ticks=50):
+    '''The planet check of `_acceleration_heuristic` for a coasting fleet over many
+    ticks, predicting from scratch vs with `_cached_trajectory`.
+    '''
+    for n_ships in sizes:
+        ticks = [(list(map(tuple, positions)), list(map(tuple, velocities)))
+                 for positions, velocities in _coasting_ticks(n_ships, n_ticks)]
+        case = f'{n_ships} ships x {n_ticks} ticks'
+
+        def uncached():
+            for positions, velocities in ticks:
+                for position, velocity in zip(positions, velocities):
+                    main._trajectory_hits_planet(main._predicted_trajectory(position, velocity))
+
+        def cached():
+            main._reset_trajectory_cache()
+            for positions, velocities in ticks:
+                for position, velocity in zip(positions, velocities):
+                    main._cached_trajectory(position, velocity)
+
+        _report(results, 'trajectory_uncached', case, _time_call(uncached))
+        seconds = _time_call(cached)
+        # Counts of one cold pass, as `cached` starts from an empty cache
+        cached()
+        stats = main._trajectory_cache_stats()
+        _report(results, 'trajectory_cached', case, seconds,
+                n_hits=stats['n_hits'], n_misses=stats['n_misses'], n_extended=stats['n_extended'])
+
+        # Second pass over the same ticks: all hits
+        _report(results, 'trajectory_cached_warm', case,
+                _time_call(lambda: [main._cached_trajectory(position, velocity)
+                                    for positions, velocities in ticks
+                                    for position, velocity in zip(positions, velocities)]))
+
+
+def bench_planner(results, n_ships=100, n_ticks=64, fuel=32):
+    '''Flying ships that would crash for `n_ticks` ticks, replanning every tick,
+    with `_acceleration_heuristic` vs `_planned_acceleration`.
+    '''
+    ships = fleets.endangered_ships(n_ships)
+
+    def heuristic(position, velocity, fuel_left):
+        return main._acceleration_heuristic(position, velocity)
+
+    for name, max_nodes in (('heuristic', None), ('planner', 8), ('planner', main.PLAN_MAX_NODES),
+                            ('planner', 128)):
+        stats = {'n_nodes': 0}
+        decide_f = heuristic if max_nodes is None else (
+            lambda position, velocity, fuel_left: main._planned_acceleration(
+                position, velocity, fuel_left,
+                max_nodes=max_nodes, stats=stats) if main._cached_trajectory(tuple(position), tuple(velocity))[1] else None)
+        n_decisions = n_survived = total_fuel_used = 0
+        start = time.perf_counter()
+        for position, velocity in ships:
+            survived, fuel_used = fleets.fly(position, velocity, decide_f, n_ticks, fuel)
+            n_survived += survived
+            total_fuel_used += fuel_used
+            n_decisions += n_ticks
+        seconds = time.perf_counter() - start
+        case = name if max_nodes is None else f'{name} max_nodes={max_nodes}'
+        _report(results, 'planner', case, seconds / n_decisions,
+                survived=f'{n_survived}/{n_ships}', mean_fuel=round(total_fuel_used / n_ships, 2),
+                nodes_per_tick=round(stats['n_nodes'] / n_decisions, 2))
+
+
+def bench_orbit_table(results, n_ships=100, n_ticks=64, fuel=32):
+    '''Building the orbit table, its memory, looking up states in it vs simulating them,
+    and the planner of `bench_planner` with it. Uses `main.ORBIT_TABLE_PATH` if it's built;
+    otherwise builds a table first and reports the build time too.
+    '''
+    path = main.ORBIT_TABLE_PATH
+    if not os.path.exists(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_orbit_table.bin')
+        start = time.perf_counter()
+        steps = build_orbit_table.build_table()
+        orbittable.write_table(path, steps, main.PLAYFIELD_RADIUS, build_orbit_table.DEFAULT_MAX_SPEED,
+                               build_orbit_table.DEFAULT_HORIZON)
+        _report(results, 'orbit_table_build', 'full playfield', time.perf_counter() - start,
+                nbytes=os.path.getsize(path))
+    start = time.perf_counter()
+    table = orbittable.OrbitTable(path)
+    _report(results, 'orbit_table_open', 'mmap', time.perf_counter() - start, nbytes=table.steps.nbytes)
+
+    positions, velocities = fleets.random_fleet(512, seed=3)
+    _report(results, 'orbit_table_lookup', '512 ships',
+            _time_call(lambda: [table.lookup(position, velocity)
+                                for position, velocity in zip(positions, velocities)]))
+    _report(results, 'orbit_table_lookup_batch', '512 ships',
+            _time_call(table.lookup_batch, positions, velocities))
+    _report(results, 'orbit_table_simulated', f'512 ships {table.horizon} steps',
+            _time_call(main._steps_until_impact_simulated, positions, velocities, table.horizon, True))
+
+    ships = fleets.endangered_ships(n_ships)
+    for name, orbit_table in (('simulated', None), ('orbit table', table)):
+        stats = {'n_nodes': 0}
+
+        def decide_f(position, velocity, fuel_left):
+            steps = orbit_table and orbit_table.lookup(position, velocity)
+            if steps is None:
+                endangered = main._cached_trajectory(tuple(position), tuple(velocity))[1]
+            else:
+                endangered = steps <= main.PLAN_HORIZON
+            if not endangered:
+                return None
+            return main._planned_acceleration(position, velocity, fuel_left, stats=stats,
+                                              orbit_table=orbit_table)
+
+        start = time.perf_counter()
+        flights = [fleets.fly(position, velocity, decide_f, n_ticks, fuel) for position, velocity in ships]
+        seconds = time.perf_counter() - start
+        _report(results, 'orbit_table_planner', name, seconds / (n_ships * n_ticks),
+                survived=f'{sum(survived for survived, _ in flights)}/{n_ships}',
+                mean_fuel=round(sum(fuel_used for _, fuel_used in flights) / n_ships, 2),
+                nodes_per_tick=round(stats['n_nodes'] / (n_ships * n_ticks), 2))
+    table.close()
+
+
+def bench_ship_grid(results, sizes=(10, 100, 1000, 4000)):
+    '''The kamikaze check for all our ships against all enemies, half of the ships each:
+    the closest enemy by looking at all of them vs `_ShipGrid`, including building it.
+    '''
+    for n_ships in sizes:
+        rng = np.random.default_rng(n_ships)
+        ours = [tuple(position) for position in rng.integers(-128, 129, size=(n_ships // 2, 2)).tolist()]
+        theirs = [tuple(position) for position in rng.integers(-128, 129, size=(n_ships // 2, 2)).tolist()]
+        case = f'{n_ships} ships'
+
+        def all_pairs():
+            return [min(main._pos_distance(position, enemy) for enemy in theirs) < main.MAX_KAMIKAZE_DISTANCE
+                    for position in ours]
+
+        def grid_within():
+            grid = main._ShipGrid(theirs)
+            return [bool(grid.within(position, main.MAX_KAMIKAZE_DISTANCE)) for position in ours]
+
+        def grid_closest():
+            grid = main._ShipGrid(theirs)
+            return [grid.closest(position)[0] < main.MAX_KAMIKAZE_DISTANCE for position in ours]
+
+        assert all_pairs() == grid_within() == grid_closest()
+        _report(results, 'ship_grid_all_pairs', case, _time_call(all_pairs, repeat=1))
+        _report(results, 'ship_grid_within', case, _time_call(grid_within))
+        _report(results, 'ship_grid_closest', case, _time_call(grid_closest))
+
+
+def bench_segments_cross_squares(results, cases=((20, 1), (64 * 20, 1), (64 * 20, 64))):
+    '''`segment_crosses_square` one pair at a time vs `segments_cross_squares`, for
+    trajectory segments against the planet and against blast squares.
+    '''
+    rng = np.random.default_rng(0)
+    for n_segments, n_squares in cases:
+        starts = rng.integers(-100, 101, size=(n_segments, 2))
+        ends = starts + rng.integers(1, 9, size=(n_segments, 2))
+        square_origins = rng.integers(-100, 101, size=(n_squares, 2))
+        square_origins[0] = 0
+        case = f'{n_segments} segments x {n_squares} squares'
+        segments = list(zip(map(tuple, starts.tolist()), map(tuple, ends.tolist())))
+        origins = list(map(tuple, square_origins.tolist()))
+        _report(results, 'segments_squares_scalar', case,
+                _time_call(lambda: [[collision.segment_crosses_square(start, end, origin, 18) for origin in origins]
+                                    for start, end in segments], repeat=1))
+        _report(results, 'segments_squares_batch', case,
+                _time_call(collision.segments_cross_squares, starts, ends, square_origins, 18))
+
+
+def bench_collision_codes(results, n_pairs=2000):
+    '''The dict-returning `intersection` and `segment_crosses_square` vs the integer kernels
+    returning codes, on random short segments near the planet, one call at a time.
+    '''
+    rng = np.random.default_rng(0)
+    starts = rng.integers(-30, 31, size=(n_pairs, 2))
+    ends = starts + rng.integers(1, 9, size=(n_pairs, 2))
+    others = rng.integers(-30, 31, size=(n_pairs, 4))
+    segments = [(tuple(start), tuple(end)) for start, end in zip(starts.tolist(), ends.tolist())]
+    coords = [start + end for start, end in zip(starts.tolist(), ends.tolist())]
+    other_coords = others.tolist()
+    case = f'{n_pairs} pairs'
+    _report(results, 'intersection_dict', case,
+            _time_call(lambda: [collision.intersection(collision.line_segment(start, end),
+                                                       collision.line_segment(tuple(other[:2]), tuple(other[2:])))
+                                for (start, end), other in zip(segments, other_coords)]))
+    _report(results, 'intersection_code', case,
+            _time_call(lambda: [collision.segment_intersection_code(*segment, *other)
+                                for segment, other in zip(coords, other_coords)]))
+    _report(results, 'crosses_square_dict', case,
+            _time_call(lambda: [collision.segment_crosses_square(start, end, (0, 0), 18) for start, end in segments]))
+    _report(results, 'crosses_square_code', case,
+            _time_call(lambda: [collision.segment_crosses_square_code(*segment, 0, 0, 18) for segment in coords]))
+    _report(results, 'segment_box_code', case,
+            _time_call(lambda: [collision.segment_box_code(*segment, -18, -18, 18, 18) for segment in coords]))
+
+
+def bench_swept_paths(results, sizes=(1, 64, 512)):
+    '''Checking 20-step trajectories for the planet: positions only, the swept path with the
+    integer fast path, the swept path with `segment_crosses_square` for every step, and batched.
+    '''
+    half = main.PLANET_SIDE_LENGTH // 2
+
+    def swept_without_fast_path(position, trajectory):
+        start = position
+        for end in trajectory:
+            if main._point_in_planet(end) or (
+                    tuple(start) != tuple(end)
+                    and collision.segment_crosses_square(tuple(start), tuple(end), (0, 0), half)):
+                return True
+            start = end
+        return False
+
+    for n_ships in sizes:
+        positions, velocities = fleets.random_fleet(n_ships, seed=4)
+        trajectories = [main._predicted_trajectory(position, velocity)
+                        for position, velocity in zip(positions, velocities)]
+        trajectories_array, _ = main._predicted_trajectories(positions, velocities)
+        case = f'{n_ships} ships'
+        _report(results, 'paths_points', case,
+                _time_call(lambda: [main._trajectory_hits_planet(trajectory) for trajectory in trajectories]))
+        _report(results, 'paths_swept', case,
+                _time_call(lambda: [main._path_hits_planet(position, trajectory)
+                                    for position, trajectory in zip(positions, trajectories)]),
+                n_hits=sum(main._path_hits_planet(position, trajectory)
+                           for position, trajectory in zip(positions, trajectories)),
+                n_point_hits=sum(map(main._trajectory_hits_planet, trajectories)))
+        _report(results, 'paths_swept_no_fast_path', case,
+                _time_call(lambda: [swept_without_fast_path(position, trajectory)
+                                    for position, trajectory in zip(positions, trajectories)]))
+        _report(results, 'paths_swept_batch', case,
+                _time_call(main._paths_hit_planet_batch, positions, trajectories_array))
+
+
+def bench_planning_pool(results, sizes=(8, 32, 128, 512), workers=(1, 2, 4)):
+    '''Planning one tick for fleets of different sizes in this process vs in a
+    `_PlanningPool`, with warm caches on both sides, and starting the pool.
+    '''
+    orbit_table = main._open_orbit_table()
+    table_path = orbit_table and orbit_table.path
+    game_states = {n_ships: fleets.fleet_game_state(n_ships) for n_ships in sizes}
+
+    def plan(game_state, planning_pool=None):
+        return main._plan_commands(game_state, 'attacker', fleets.FIRST_SHIP_ID, np.random.default_rng(0), 0,
+                                   orbit_table=orbit_table, planning_pool=planning_pool)
+
+    serial_seconds = {}
+    for n_ships, game_state in game_states.items():
+        serial_seconds[n_ships] = _time_call(plan, game_state)
+        _report(results, 'planning_serial', f'{n_ships} ships', serial_seconds[n_ships])
+    for n_workers in workers:
+        start = time.perf_counter()
+        planning_pool = main._PlanningPool(n_workers, table_path)
+        _report(results, 'planning_pool_start', f'{n_workers} workers', time.perf_counter() - start)
+        with planning_pool:
+            for n_ships, game_state in game_states.items():
+                # Big enough fleets only; smaller ones are planned here anyway
+                if n_ships < main.PLANNING_POOL_MIN_SHIPS:
+                    continue
+                assert plan(game_state, planning_pool) == plan(game_state)
+                seconds = _time_call(plan, game_state, planning_pool)
+                _report(results, 'planning_pool', f'{n_ships} ships, {n_workers} workers', seconds,
+                        speedup=round(serial_seconds[n_ships] / seconds, 2))
+    if orbit_table is not None:
+        orbit_table.close()
+    _report(results, 'planning_cpus', 'os.cpu_count()', 0.0, n_cpus=os.cpu_count())
+
+
+BENCHMARKS = [bench_codec,
+              bench_decode_scaling,
+              bench_encode_scaling,
+              bench_commands_request,
+              bench_batch_codec,
+              bench_decoded_memory,
+              bench_simulated_games,
+              bench_logging,
+              bench_replay,
+              bench_trajectories,
+              bench_trajectory_cache,
+              bench_planner,
+              bench_orbit_table,
+              bench_ship_grid,
+              bench_segments_cross_squares,
+              bench_collision_codes,
+              bench_swept_paths,
+              bench_planning_pool]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(base, results):
+    '''Prints the time ratio of each result to the same benchmark and case in `base`.'''
+    base_seconds = {(row['benchmark'], row['case']): row['seconds'] for row in base['results']}
+    print(f'\ncompared to {base.get("commit")} (ratio > 1 is slower now)')
+    for row in results:
+        key = (row['benchmark'], row['case'])
+        if key in base_seconds:
+            print(f'{row["benchmark"]:24} {row["case"]:34} {row["seconds"] / base_seconds[key]:6.2f}x')
+
+
+def run(names=None, json_path=None, compare_path=None):
+    results = []
+    for bench_f in BENCHMARKS:
+        if names and not any(name in bench_f.__name__ for name in names):
+            continue
+        bench_f(results)
+
+    run_info = {'commit': _git_commit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'results': results}
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(run_info, f, indent=1)
+    if compare_path is not None:
+        with open(compare_path) as f:
+            _compare(json.load(f), results)
+    return run_info
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmarks for the hot paths of the bot.')
+    parser.add_argument('-k', dest='names', action='append',
+                        help='only run benchmarks whose name contains this, can be repeated')
+    parser.add_argument('--json', dest='json_path', help='save the results to this file')
+    parser.add_argument('--compare', dest='compare_path', help='compare with results saved with --json')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = _parse_args(sys.argv[1:])
+    run(args.names, args.json_path, args.compare_path)
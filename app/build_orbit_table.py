@@ -0,0 +1,96 @@
+'''Builds the orbit table the bot memory-maps, see `orbittable.py`:
+
+    python app/build_orbit_table.py [path] [--max-speed 16] [--horizon 254]
+
+Every state's next state is found once with the gravity rules of `main`, and
+then the steps until each state is lost are counted backwards from the
+states that are lost in one step, one more step per pass over the table,
+instead of simulating each state on its own.
+'''
+import argparse
+import sys
+import time
+
+import numpy as np
+
+try:
+    from app import main
+    from app import orbittable
+except ImportError:
+    import main
+    import orbittable
+
+
+DEFAULT_PATH = 'app/orbit_table.bin'
+DEFAULT_MAX_SPEED = 16
+DEFAULT_HORIZON = int(orbittable.NO_IMPACT) - 1
+
+
+def _next_states(radius, max_speed) -> np.ndarray:
+    '''Flat index into the table of every state's next state, after mirroring it into
+    x >= 0, y >= 0, or the index one past the end if the ship is lost in that step.
+    '''
+    shape = orbittable.table_shape(radius, max_speed)
+    n_states = int(np.prod(shape))
+    next_states = np.empty(shape, dtype=np.int32)
+    coords = np.arange(radius + 1)
+    speeds = np.arange(-max_speed, max_speed + 1)
+    # One x at a time keeps the temporaries small
+    for x in coords:
+        y, vx, vy = np.meshgrid(coords, speeds, speeds, indexing='ij')
+        position = np.stack([np.full_like(y, x), y], axis=-1)
+        velocity = np.stack([vx, vy], axis=-1)
+        velocity = velocity + main._gravity_batch(position)
+        position = position + velocity
+
+        lost = (main._points_in_planet_batch(position)
+                | np.any(np.abs(position) > radius, axis=-1)
+                | np.any(np.abs(velocity) > max_speed, axis=-1))
+        signs = np.where(position < 0, -1, 1)
+        position = position * signs
+        velocity = velocity * signs + max_speed
+        index = np.ravel_multi_index((np.clip(position[..., 0], 0, radius), np.clip(position[..., 1], 0, radius),
+                                      np.clip(velocity[..., 0], 0, 2 * max_speed),
+                                      np.clip(velocity[..., 1], 0, 2 * max_speed)), shape)
+        next_states[x] = np.where(lost, n_states, index)
+    return next_states.reshape(-1)
+
+
+def build_table(radius=main.PLAYFIELD_RADIUS, max_speed=DEFAULT_MAX_SPEED,
+                horizon=DEFAULT_HORIZON) -> np.ndarray:
+    '''Steps until every state in `orbittable.table_shape(radius, max_speed)` is lost,
+    or `orbittable.NO_IMPACT` if it isn't within `horizon` steps.
+    '''
+    if horizon >= orbittable.NO_IMPACT:
+        raise ValueError(f'horizon must be below {orbittable.NO_IMPACT}')
+    shape = orbittable.table_shape(radius, max_speed)
+    next_states = _next_states(radius, max_speed)
+    # After pass k, `steps` is the steps until lost, or k if that's more.
+    # The extra state at the end is the one lost states go to.
+    steps = np.zeros(len(next_states) + 1, dtype=np.uint8)
+    for _ in range(horizon + 1):
+        np.minimum(steps[next_states], horizon, out=steps[:-1])
+        steps[:-1] += 1
+
+    steps = steps[:-1].reshape(shape)
+    steps[steps > horizon] = orbittable.NO_IMPACT
+    # Ships in the planet are lost already
+    coords = np.arange(radius + 1)
+    in_planet = main._points_in_planet_batch(np.stack(np.meshgrid(coords, coords, indexing='ij'), axis=-1))
+    steps[in_planet] = 0
+    return steps
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the orbit table for the bot.')
+    parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+    parser.add_argument('--max-speed', type=int, default=DEFAULT_MAX_SPEED)
+    parser.add_argument('--horizon', type=int, default=DEFAULT_HORIZON)
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    steps = build_table(max_speed=args.max_speed, horizon=args.horizon)
+    orbittable.write_table(args.path, steps, main.PLAYFIELD_RADIUS, args.max_speed, args.horizon)
+    print(f'{args.path}: {steps.nbytes / 2 ** 20:.1f} MB, '
+          f'{np.mean(steps == orbittable.NO_IMPACT) * 100:.1f}% of states safe, '
+          f'built in {time.perf_counter() - start_time:.1f} s', file=sys.stderr)
@@ -0,0 +1,66 @@
+'''Fleets and flights shared by the tests and `bench.py`, so that both plan for
+the same ships and judge the planner the same way.
+'''
+import typing as t
+
+import numpy as np
+
+try:
+    from app import main
+except ImportError:
+    import main
+
+
+def random_fleet(n_ships, seed=0) -> t.Tuple[t.List[t.List[int]], t.List[t.List[int]]]:
+    '''`(positions, velocities)` of `n_ships` random ships around the planet.'''
+    rng = np.random.default_rng(seed)
+    return (rng.integers(-100, 101, size=(n_ships, 2)).tolist(),
+            rng.integers(-8, 9, size=(n_ships, 2)).tolist())
+
+
+def endangered_ships(n_ships, seed=0) -> t.List[t.Tuple[t.List[int], t.List[int]]]:
+    '''`(position, velocity)` of random ships whose coasting trajectory hits the planet.'''
+    rng = np.random.default_rng(seed)
+    ships = []
+    while len(ships) < n_ships:
+        position = rng.integers(-60, 61, size=2).tolist()
+        velocity = rng.integers(-6, 7, size=2).tolist()
+        if not main._point_in_planet(position) and main._cached_trajectory(tuple(position), tuple(velocity))[1]:
+            ships.append((position, velocity))
+    return ships
+
+
+def fly(position, velocity, decide_f, n_ticks=40, fuel=32) -> t.Tuple[bool, int]:
+    '''Flies a ship for `n_ticks`, accelerating as `decide_f(position, velocity, fuel left)`
+    says while it has fuel. Returns whether it survived, and the fuel it used.
+    '''
+    fuel_used = 0
+    for _ in range(n_ticks):
+        acceleration = decide_f(position, velocity, fuel - fuel_used)
+        if acceleration is not None and acceleration != [0, 0] and fuel_used < fuel:
+            velocity = [velocity[0] - acceleration[0], velocity[1] - acceleration[1]]
+            fuel_used += 1
+        velocity = main._next_velocity(position, velocity)
+        position = main._next_position(position, velocity)
+        if main._point_in_planet(position) or max(map(abs, position)) > main.PLAYFIELD_RADIUS:
+            return False, fuel_used
+    return True, fuel_used
+
+
+ENEMY_SHIP_ID = 1
+FIRST_SHIP_ID = 2
+
+
+def fleet_game_state(n_ships, seed=0) -> main.GameState:
+    '''A game state with one defender, `ENEMY_SHIP_ID`, and `n_ships` attackers from
+    `FIRST_SHIP_ID` on, half of them about to crash, with different amounts of fuel.
+    One more attacker after them has a single bomb left next to the defender, so
+    it detonates instead of planning.
+    '''
+    positions, velocities = random_fleet(n_ships - n_ships // 2, seed=seed)
+    ships = list(zip(positions, velocities)) + endangered_ships(n_ships // 2, seed=seed)
+    enemy = main.Ship('defender', ENEMY_SHIP_ID, [-60, -60], [0, 0], [64, 0, 0, 1], 0, 64, 1)
+    ours = [main.Ship('attacker', ship_id, position, velocity, [ship_id % 64, 0, 0, 2 + ship_id % 3], 0, 64, 1)
+            for ship_id, (position, velocity) in enumerate(ships, start=FIRST_SHIP_ID)]
+    kamikaze = main.Ship('attacker', FIRST_SHIP_ID + n_ships, [-65, -60], [0, 5], [10, 0, 0, 1], 0, 64, 1)
+    return main.GameState(1, None, [main.ShipAndCommands(ship, []) for ship in [enemy] + ours + [kamikaze]])
@@ -0,0 +1,150 @@
+'''Leveled JSON-lines logging for the bot, one object per line:
+
+    {"time": 1594922000.123, "level": "info", "msg": "joined", "our_role": "attacker"}
+
+Records below the logger's level cost one comparison. `data` can be a callable
+returning the dict, so that expensive values aren't even built unless they're
+logged. Formatting and writing can be moved to a background thread with
+`background=True`; then the data must not be changed after logging it.
+
+`main.py` configures the logger from the `BOT_LOG_LEVEL` environment variable:
+`debug`, `info` (the default), `warning`, `error` or `quiet`.
+'''
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import typing as t
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+QUIET = 100
+
+LEVELS = {'debug': DEBUG,
+          'info': INFO,
+          'warning': WARNING,
+          'error': ERROR,
+          'quiet': QUIET}
+_LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
+
+Data = t.Union[None, dict, t.Callable[[], dict]]
+
+
+def _to_json(obj):
+    '''Fallback for values `json` doesn't know, like the game records and `Cons`.'''
+    if hasattr(obj, '_fields'):
+        # Cons
+        return list(obj)
+    slots = getattr(type(obj), '__slots__', None)
+    if slots:
+        return {name: getattr(obj, name) for name in slots}
+    if hasattr(obj, 'item'):
+        # NumPy scalars
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    return repr(obj)
+
+
+class Logger:
+    def __init__(self, stream: t.TextIO = None, level=INFO, background=False):
+        self.stream = stream
+        self.level = level
+        self._encoder = json.JSONEncoder(default=_to_json, check_circular=False, separators=(',', ':'))
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._write_queued, name='jsonlog', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def enabled(self, level) -> bool:
+        return level >= self.level
+
+    def log(self, level, msg: str, data: Data = None):
+        if level < self.level:
+            return
+        record = (time.time(), level, msg, data)
+        if self._queue is not None:
+            self._queue.put(record)
+        else:
+            self._write(record)
+
+    def debug(self, msg, data: Data = None):
+        self.log(DEBUG, msg, data)
+
+    def info(self, msg, data: Data = None):
+        self.log(INFO, msg, data)
+
+    def warning(self, msg, data: Data = None):
+        self.log(WARNING, msg, data)
+
+    def error(self, msg, data: Data = None):
+        self.log(ERROR, msg, data)
+
+    def format(self, record) -> str:
+        timestamp, level, msg, data = record
+        if callable(data):
+            data = data()
+        fields = {'time': round(timestamp, 6), 'level': _LEVEL_NAMES.get(level, level), 'msg': msg}
+        if isinstance(data, dict):
+            fields.update(data)
+        elif data is not None:
+            fields['data'] = data
+        return self._encoder.encode(fields)
+
+    def _write(self, record):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(self.format(record) + '\n')
+
+    def _write_queued(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            lines = [record]
+            # Write whatever piled up in one go
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.put(None)
+                    break
+                lines.append(record)
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write(''.join(self.format(record) + '\n' for record in lines))
+            stream.flush()
+
+    def close(self):
+        '''Waits until every record was written. Logging later writes synchronously.'''
+        if self._queue is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._queue = None
+        self._thread = None
+
+
+def from_env(environ=None, **kwargs) -> Logger:
+    '''Logger with the level from `BOT_LOG_LEVEL`, or `INFO` with a warning if that isn't
+    one of `LEVELS`, and, if `BOT_LOG_BACKGROUND` is set to 1, a background writer.
+    '''
+    if environ is None:
+        environ = os.environ
+    level_name = environ.get('BOT_LOG_LEVEL', 'info').lower()
+    level = LEVELS.get(level_name)
+    background = environ.get('BOT_LOG_BACKGROUND', '0') == '1'
+    logger = Logger(level=INFO if level is None else level, background=background, **kwargs)
+    if level is None:
+        logger.warning('unknown BOT_LOG_LEVEL, logging at info',
+                       {'BOT_LOG_LEVEL': level_name, 'levels': list(LEVELS)})
+    return logger
@@ -0,0 +1,104 @@
+'''Steps until a coasting ship is lost, for every position and velocity on the
+playfield, precomputed by `build_orbit_table.py` and memory-mapped by the bot.
+
+A ship is lost when it's in the planet, leaves the playfield, or gets faster
+than the table's max speed on either axis (so the table can't follow it).
+Gravity is symmetric to mirroring either axis, so only positions with
+x >= 0 and y >= 0 are stored. The file is a magic header followed by
+
+    radius       uint16, little endian: positions from -radius to radius
+    max speed    uint16, little endian: velocities from -max speed to max speed
+    horizon      uint16, little endian: steps simulated
+    steps        uint8 per state, C order over
+                 (x: 0..radius, y: 0..radius, vx: -max speed.., vy: -max speed..),
+                 or NO_IMPACT if the ship isn't lost within the horizon
+
+so the full playfield with speeds up to 16 takes 18 MB.
+'''
+import os
+import struct
+import typing as t
+
+import numpy as np
+
+
+MAGIC = b'ALIENORB1\n'
+_HEADER = struct.Struct('<HHH')
+NO_IMPACT = np.iinfo(np.uint8).max
+
+
+def table_shape(radius, max_speed) -> t.Tuple[int, int, int, int]:
+    return (radius + 1, radius + 1, 2 * max_speed + 1, 2 * max_speed + 1)
+
+
+def write_table(path, steps: np.ndarray, radius, max_speed, horizon):
+    '''Writes `steps`, of shape `table_shape(radius, max_speed)`, next to `path`
+    first and then moves it there, so readers never see half a table.
+    '''
+    steps = np.ascontiguousarray(steps, dtype=np.uint8)
+    if steps.shape != table_shape(radius, max_speed):
+        raise ValueError(f'Expected shape {table_shape(radius, max_speed)}, got {steps.shape}')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_HEADER.pack(radius, max_speed, horizon))
+        f.write(steps.tobytes())
+    os.replace(tmp_path, path)
+
+
+class OrbitTable:
+    '''Memory-mapped table. `lookup` and `lookup_batch` don't simulate anything.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'Not an orbit table: {path}')
+            self.radius, self.max_speed, self.horizon = _HEADER.unpack(f.read(_HEADER.size))
+            shape = table_shape(self.radius, self.max_speed)
+            f.seek(0, 2)
+            if f.tell() != len(MAGIC) + _HEADER.size + int(np.prod(shape)):
+                raise ValueError(f'Truncated orbit table: {path}')
+        # Unmapped once nothing uses the array anymore
+        self.steps = np.asarray(np.memmap(path, dtype=np.uint8, mode='r',
+                                          offset=len(MAGIC) + _HEADER.size, shape=shape))
+
+    def lookup(self, position, velocity) -> t.Optional[int]:
+        '''Steps until a ship coasting from `position` with `velocity` is lost, `NO_IMPACT`
+        if it isn't within the horizon, or None if the state isn't in the table.
+        '''
+        [x, y] = position
+        [vx, vy] = velocity
+        if x < 0:
+            x, vx = -x, -vx
+        if y < 0:
+            y, vy = -y, -vy
+        if x > self.radius or y > self.radius or abs(vx) > self.max_speed or abs(vy) > self.max_speed:
+            return None
+        return int(self.steps[x, y, vx + self.max_speed, vy + self.max_speed])
+
+    def lookup_batch(self, positions, velocities) -> t.Tuple[np.ndarray, np.ndarray]:
+        '''`lookup` of every position and velocity: the steps, as uint8, and whether each
+        state is in the table. Steps of states that aren't are `NO_IMPACT`.
+        '''
+        positions = np.asarray(positions, dtype=np.int64)
+        positions, velocities = np.broadcast_arrays(positions, np.asarray(velocities, dtype=np.int64))
+        # Mirror into x >= 0, y >= 0
+        signs = np.where(positions < 0, -1, 1)
+        positions = positions * signs
+        velocities = velocities * signs + self.max_speed
+        in_table = (np.all(positions <= self.radius, axis=-1)
+                    & np.all((velocities >= 0) & (velocities <= 2 * self.max_speed), axis=-1))
+        steps = np.full(in_table.shape, NO_IMPACT, dtype=np.uint8)
+        positions, velocities = positions[in_table], velocities[in_table]
+        steps[in_table] = self.steps[positions[:, 0], positions[:, 1], velocities[:, 0], velocities[:, 1]]
+        return steps, in_table
+
+    def close(self):
+        self.steps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,131 @@
+'''Recording the exact bit strings exchanged with the server, one file per
+player and game. See `replay.py` for playing them back.
+
+The file is a magic header followed by one record per request/response
+exchange, appended as they happen:
+
+    exchange index    uint32, little endian
+    request bits      uint32, little endian
+    response bits     uint32, little endian
+    request           the bits packed 8 per byte, first bit in the highest bit
+    response          the same
+
+so a recording takes about an eighth of the bit strings themselves, and a
+crash loses at most the exchange being written.
+'''
+import mmap
+import struct
+import typing as t
+
+import numpy as np
+
+
+MAGIC = b'ALIENREC1\n'
+_HEADER = struct.Struct('<III')
+
+
+def _pack_bits(bits: str) -> bytes:
+    return np.packbits(np.frombuffer(bits.encode('ascii'), dtype=np.uint8) - ord('0')).tobytes()
+
+
+def _unpack_bits(data, n_bits) -> str:
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=n_bits)
+    return (bits + ord('0')).tobytes().decode('ascii')
+
+
+def _records(data, pos) -> t.Iterator[t.Tuple[int, int, int, int]]:
+    '''`(exchange_i, n_request_bits, n_response_bits, start)` of the whole records in
+    `data` from `pos` on, with `start` where the record's request bits begin.
+    '''
+    while pos + _HEADER.size <= len(data):
+        exchange_i, n_request_bits, n_response_bits = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        end = start + (n_request_bits + 7) // 8 + (n_response_bits + 7) // 8
+        if end > len(data):
+            return
+        yield exchange_i, n_request_bits, n_response_bits, start
+        pos = end
+
+
+class Recorder:
+    '''Appends exchanges to `path`. Appending to an existing recording numbers the
+    exchanges on from its last whole record, and drops a record cut off after it.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        self.n_exchanges = 0
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            return
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                self._file.close()
+                raise ValueError(f'Not a recording: {path}')
+            data = f.read()
+        end = 0
+        for exchange_i, n_request_bits, n_response_bits, start in _records(data, 0):
+            self.n_exchanges = exchange_i + 1
+            end = start + (n_request_bits + 7) // 8 + (n_response_bits + 7) // 8
+        if end < len(data):
+            self._file.truncate(len(MAGIC) + end)
+
+    def record(self, request_bits: t.Union[str, bytes], response_bits: t.Union[str, bytes]):
+        '''Appends one exchange. The bits can be `str` or ASCII `bytes` of 0s and 1s.'''
+        if isinstance(request_bits, bytes):
+            request_bits = request_bits.decode('ascii')
+        if isinstance(response_bits, bytes):
+            response_bits = response_bits.decode('ascii')
+        self._file.write(_HEADER.pack(self.n_exchanges, len(request_bits), len(response_bits)) +
+                         _pack_bits(request_bits) + _pack_bits(response_bits))
+        # Keep whole exchanges on disk in case the bot dies mid-game
+        self._file.flush()
+        self.n_exchanges += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Recording:
+    '''Memory-mapped recording. Iterating gives `(exchange_i, request_bits, response_bits)`.
+    A record cut off at the end of the file, e.g. by a crash, is ignored.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'Not a recording: {path}')
+            f.seek(0, 2)
+            size = f.tell()
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > len(MAGIC) else None
+
+    def __iter__(self) -> t.Iterator[t.Tuple[int, str, str]]:
+        if self._mmap is None:
+            return
+        # Slicing the mmap copies the bytes, so no view on it outlives a `next()` and
+        # `close()` works with an iteration left unfinished
+        data = self._mmap
+        for exchange_i, n_request_bits, n_response_bits, start in _records(data, len(MAGIC)):
+            response_start = start + (n_request_bits + 7) // 8
+            end = response_start + (n_response_bits + 7) // 8
+            yield (exchange_i,
+                   _unpack_bits(data[start:response_start], n_request_bits),
+                   _unpack_bits(data[response_start:end], n_response_bits))
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
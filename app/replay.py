@@ -0,0 +1,109 @@
+'''Plays back games recorded with `recording.Recorder` without a server:
+every response goes through `parse_response_body` and `_parse_game_response`,
+and every game state the bot got is planned for again like in `main.main`.
+Recorded games are then reproducible benchmarks and regression fixtures.
+
+    python app/replay.py <recording> [--repeat N]
+
+prints the tick profile of the replay. Record games by setting
+`BOT_RECORD_PATH`, e.g. to `games/{player_key}.rec`, when running `main.py`.
+'''
+import argparse
+import json
+import sys
+import time
+import typing as t
+
+import numpy as np
+
+try:
+    from app import main
+    from app import recording
+    from app import tickprofile
+except ImportError:
+    import main
+    import recording
+    import tickprofile
+
+
+_JOIN, _START, _COMMANDS = 2, 3, 4
+
+
+def recorded_responses(path) -> t.Iterator[t.Tuple[main.DSL, t.Optional[main.GameResponse]]]:
+    '''`(request, response)` for every exchange in the recording. The response is
+    parsed into a `GameResponse` for join, start and commands requests, and None
+    otherwise.
+    '''
+    with recording.Recording(path) as rec:
+        for _, request_bits, response_bits in rec:
+            request = main.parse_response_body(request_bits)
+            response = None
+            if isinstance(request, list) and request and request[0] in (_JOIN, _START, _COMMANDS):
+                response = main._parse_game_response(main.parse_response_body(response_bits))
+            yield request, response
+
+
+def replay(path, plan_f=main._plan_commands, seed=0,
+           profiler: tickprofile.TickProfiler = None) -> tickprofile.TickProfiler:
+    '''Replays one recording. Each tick of the profiler covers decoding and parsing
+    a response and planning and encoding the commands for it; there's no network.
+    '''
+    if profiler is None:
+        profiler = tickprofile.TickProfiler()
+    rng = np.random.default_rng(seed)
+    our_role = our_ship_id = None
+    player_key = 0
+    shots_done_count = 0
+
+    with recording.Recording(path) as rec:
+        for _, request_bits, response_bits in rec:
+            request = main.parse_response_body(request_bits)
+            if not (isinstance(request, list) and request and request[0] in (_JOIN, _START, _COMMANDS)):
+                continue
+            player_key = request[1]
+
+            decode_start_time = time.perf_counter()
+            response_dsl = main.parse_response_body(response_bits)
+            parse_start_time = time.perf_counter()
+            response = main._parse_game_response(response_dsl)
+            parsed_time = time.perf_counter()
+            profiler.add('decode', parse_start_time - decode_start_time)
+            profiler.add('parse', parsed_time - parse_start_time)
+            profiler.add('response_bits', len(response_bits))
+
+            if request[0] == _JOIN:
+                our_role = response.role
+            elif request[0] == _START:
+                our_ship_id = main._extract_ship_ids(response).get(our_role)
+
+            if (request[0] == _JOIN or response.game_state is None
+                    or response.game_stage == 'finished'):
+                profiler.discard_tick()
+                continue
+
+            plan_start_time = time.perf_counter()
+            cmds, shots_done_count = plan_f(response.game_state, our_role, our_ship_id,
+                                            rng, shots_done_count)
+            encode_start_time = time.perf_counter()
+            request_body = main.make_request_body(main._commands_request_template(player_key, cmds))
+            encoded_time = time.perf_counter()
+            profiler.add('plan', encode_start_time - plan_start_time)
+            profiler.add('encode', encoded_time - encode_start_time)
+            profiler.add('request_bits', len(request_body))
+            profiler.end_tick(n_ships=len(response.game_state.ships_and_commands))
+
+    return profiler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded game without a server.')
+    parser.add_argument('path')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    profiler = tickprofile.TickProfiler()
+    for i in range(args.repeat):
+        replay(args.path, seed=args.seed + i, profiler=profiler)
+    json.dump(profiler.summary(), sys.stdout, indent=1)
+    print()
@@ -0,0 +1,494 @@
+'''Local, deterministic stand-in for the game server, for playing whole games
+offline and measuring how fast the bot plays them.
+
+The rules are our best understanding of the real ones: gravity from
+`main._calculate_gravity`, a square planet of `main.PLANET_SIDE_LENGTH`,
+accelerating costs fuel and heats the ship up, forking splits off a new ship,
+detonating destroys every ship around, and shots heat up the ships they hit.
+Overheated ships lose their parameters, and ships die when they hit the planet,
+leave the world or have no parameters left.
+
+In-process, `Simulator.send` is a `sender_f` for `main.send_join` and friends
+(one thread per player, like `main._test_forking`), and `play_local_game`
+plays both sides in lockstep without any threads:
+
+    >>> responses, stats = play_local_game(seed=1)
+    >>> stats['ticks_per_second']
+
+Over HTTP, serve it on `/aliens/send` and point `main.py` or `aio.py` at it:
+
+    python app/simulator.py serve --port 8001
+    python app/simulator.py bench --games 5
+'''
+import argparse
+import functools as fnt
+import http.server
+import random
+import socket
+import threading
+import time
+import typing as t
+
+import numpy as np
+
+try:
+    from app import main
+    from app import recording
+except ImportError:
+    import main
+    import recording
+
+
+WORLD_RADIUS = 128
+MAX_SHIP_PARAMS_COST = 512
+# Cost of one unit of fuel, ammo, coolant and bombs when starting
+SHIP_PARAM_COSTS = (1, 4, 12, 2)
+MAX_HEAT = 64
+ACCELERATION_HEAT = 8
+# Ships this close to a detonation in both coordinates are destroyed
+DETONATION_RADIUS = 10
+# Shots hit ships this close to the target in both coordinates
+SHOT_HIT_RADIUS = 3
+PLAYER_TIMEOUT_SECONDS = 10
+
+_ATTACKER, _DEFENDER = 0, 1
+
+
+class _SimShip:
+    __slots__ = ('role', 'ship_id', 'position', 'velocity', 'params', 'heat', 'applied_commands')
+
+    def __init__(self, role, ship_id, position, velocity, params):
+        self.role = role
+        self.ship_id = ship_id
+        self.position = position
+        self.velocity = velocity
+        # [fuel, ammo, coolant, bombs]
+        self.params = params
+        self.heat = 0
+        self.applied_commands = []
+
+    def to_dsl(self) -> main.DSL:
+        return [[self.role, self.ship_id,
+                 main.Cons(*self.position), main.Cons(*self.velocity),
+                 list(self.params), self.heat, MAX_HEAT, 1],
+                self.applied_commands]
+
+
+class Game:
+    '''One game. Not thread-safe; `Simulator` locks around it.
+    Each player joins, starts and then sends commands once per tick. A step is
+    done when both players made it, which bumps `n_steps`.
+    '''
+
+    def __init__(self, seed, max_n_ticks=main.MAX_N_ROUNDS):
+        self.rng = random.Random(seed)
+        self.max_n_ticks = max_n_ticks
+        self.player_keys = (self.rng.getrandbits(60), self.rng.getrandbits(60))
+        self.game_stage = 0
+        self.game_tick = 0
+        self.n_steps = 0
+        self.ships = []
+        self._next_ship_id = 0
+        self._joined = set()
+        self._start_params = {}
+        self._pending_commands = {}
+
+    def join(self, role):
+        self._joined.add(role)
+        if len(self._joined) == 2:
+            self.n_steps += 1
+
+    def start(self, role, params):
+        '''Invalid parameters are replaced by the cheapest ship.'''
+        try:
+            params = [int(param) for param in params]
+        except (TypeError, ValueError):
+            params = []
+        if (len(params) != 4 or min(params) < 0 or params[0] < 1 or params[3] < 1
+                or sum(cost * param for cost, param in zip(SHIP_PARAM_COSTS, params)) > MAX_SHIP_PARAMS_COST):
+            params = [1, 0, 0, 1]
+        self._start_params[role] = params
+        if len(self._start_params) == 2:
+            self._place_ships()
+            self.game_stage = 1
+            self.n_steps += 1
+
+    def _place_ships(self):
+        planet_radius = main.PLANET_SIDE_LENGTH // 2
+        x = self.rng.randint(planet_radius + 8, WORLD_RADIUS // 2)
+        y = self.rng.randint(-WORLD_RADIUS // 2, WORLD_RADIUS // 2)
+        # Opposite sides of the planet
+        for role, position in [(_ATTACKER, (x, y)), (_DEFENDER, (-x, -y))]:
+            self.ships.append(_SimShip(role, self._new_ship_id(), position, (0, 0),
+                                       list(self._start_params[role])))
+
+    def _new_ship_id(self):
+        ship_id = self._next_ship_id
+        self._next_ship_id += 1
+        return ship_id
+
+    def submit_commands(self, role, commands):
+        self._pending_commands[role] = commands or []
+        if len(self._pending_commands) == 2:
+            self._step()
+            self._pending_commands = {}
+            self.n_steps += 1
+
+    def _step(self):
+        by_ship_id = {}
+        for role, commands in self._pending_commands.items():
+            for command in commands:
+                try:
+                    command_type, ship_id, *args = command
+                except (TypeError, ValueError):
+                    continue
+                by_ship_id.setdefault((role, ship_id), []).append((command_type, args))
+
+        shots = []
+        detonated = []
+        for ship in list(self.ships):
+            ship.applied_commands = []
+            for command_type, args in by_ship_id.get((ship.role, ship.ship_id), []):
+                if command_type == 0:
+                    self._accelerate(ship, *args[:1])
+                elif command_type == 1:
+                    detonated.append(ship)
+                elif command_type == 2 and len(args) >= 2:
+                    shots.append(self._shoot(ship, *args[:2]))
+                elif command_type == 3 and args:
+                    self._fork(ship, args[0])
+
+        for ship in detonated:
+            if ship in self.ships:
+                self._detonate(ship)
+
+        for ship in self.ships:
+            ship.velocity = tuple(main._next_velocity(ship.position, ship.velocity))
+            ship.position = tuple(main._next_position(ship.position, ship.velocity))
+
+        for shooter, target, power, applied_command in shots:
+            applied_command[3] = self._resolve_shot(shooter, target, power)
+
+        for ship in self.ships:
+            self._cool_down(ship)
+        self.ships = [ship for ship in self.ships if self._is_alive(ship)]
+
+        self.game_tick += 1
+        roles = {ship.role for ship in self.ships}
+        if len(roles) < 2 or self.game_tick >= self.max_n_ticks:
+            self.game_stage = 2
+
+    def _accelerate(self, ship, vector=None):
+        try:
+            acc_x, acc_y = vector
+        except (TypeError, ValueError):
+            return
+        acc_x, acc_y = main._clamp(acc_x, 2), main._clamp(acc_y, 2)
+        if (acc_x, acc_y) == (0, 0) or ship.params[0] < 1:
+            return
+        vel_x, vel_y = ship.velocity
+        # Like the real server, the ship moves against the given vector
+        ship.velocity = (vel_x - acc_x, vel_y - acc_y)
+        ship.params[0] -= 1
+        ship.heat += ACCELERATION_HEAT
+        ship.applied_commands.append([0, main.Cons(acc_x, acc_y)])
+
+    def _shoot(self, ship, target, power):
+        try:
+            target_x, target_y = target
+        except (TypeError, ValueError):
+            target_x, target_y = ship.position
+        power = max(0, min(power if isinstance(power, int) else 0, ship.params[1]))
+        ship.heat += power
+        applied_command = [2, main.Cons(target_x, target_y), power, 0, 4]
+        ship.applied_commands.append(applied_command)
+        return ship, (target_x, target_y), power, applied_command
+
+    def _resolve_shot(self, shooter, target, power) -> int:
+        '''Heats up every enemy ship near `target`, returns the total damage.'''
+        damage = 0
+        for ship in self.ships:
+            if ship.role != shooter.role and _chebyshev_distance(ship.position, target) <= SHOT_HIT_RADIUS:
+                ship.heat += power
+                damage += power
+        return damage
+
+    def _fork(self, ship, child_params):
+        try:
+            child_params = [int(param) for param in child_params]
+        except (TypeError, ValueError):
+            return
+        if (len(child_params) != 4 or ship.params[3] < 2 or child_params[3] < 1
+                or min(child_params) < 0
+                or any(child > parent for child, parent in zip(child_params, ship.params))):
+            return
+        for i, param in enumerate(child_params):
+            ship.params[i] -= param
+        self.ships.append(_SimShip(ship.role, self._new_ship_id(),
+                                   ship.position, ship.velocity, child_params))
+        ship.applied_commands.append([3, list(child_params)])
+
+    def _detonate(self, detonated_ship):
+        self.ships = [ship for ship in self.ships
+                      if (ship is not detonated_ship and
+                          _chebyshev_distance(ship.position, detonated_ship.position) > DETONATION_RADIUS)]
+
+    def _cool_down(self, ship):
+        ship.heat = max(0, ship.heat - ship.params[2])
+        overheat = ship.heat - MAX_HEAT
+        if overheat <= 0:
+            return
+        ship.heat = MAX_HEAT
+        for i in range(len(ship.params)):
+            drained = min(overheat, ship.params[i])
+            ship.params[i] -= drained
+            overheat -= drained
+
+    def _is_alive(self, ship):
+        return (not main._point_in_planet(ship.position)
+                and _chebyshev_distance(ship.position, (0, 0)) <= WORLD_RADIUS
+                and any(ship.params))
+
+    def response(self, role) -> main.DSL:
+        '''What the server answers to `role` after its latest request.'''
+        static_game_info = [self.max_n_ticks, role,
+                            [MAX_SHIP_PARAMS_COST, 1, MAX_HEAT],
+                            [main.PLANET_SIDE_LENGTH // 2, WORLD_RADIUS],
+                            self._start_params.get(role)]
+        if self.game_stage == 0:
+            game_state = None
+        else:
+            game_state = [self.game_tick,
+                          [main.PLANET_SIDE_LENGTH // 2, WORLD_RADIUS],
+                          [ship.to_dsl() for ship in self.ships]]
+        return [1, self.game_stage, static_game_info, game_state]
+
+
+def _chebyshev_distance(a, b):
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+
+class Simulator:
+    '''All the games of one server. `handle` answers a decoded request like the
+    real server, so it waits until the other player of the game made the same
+    step (or `player_timeout` seconds passed). Thread-safe.
+    '''
+
+    def __init__(self, seed=0, max_n_ticks=main.MAX_N_ROUNDS, player_timeout=PLAYER_TIMEOUT_SECONDS):
+        self.seed = seed
+        self.max_n_ticks = max_n_ticks
+        self.player_timeout = player_timeout
+        self.games = []
+        self._players = {}
+        self._condition = threading.Condition()
+
+    def create_game(self) -> Game:
+        with self._condition:
+            game = Game(f'{self.seed}/{len(self.games)}', self.max_n_ticks)
+            self.games.append(game)
+            for role, player_key in enumerate(game.player_keys):
+                self._players[player_key] = (game, role)
+        return game
+
+    def handle(self, request: main.DSL) -> main.DSL:
+        if request == [1, 0]:
+            game = self.create_game()
+            return [1, [[role, player_key] for role, player_key in enumerate(game.player_keys)]]
+
+        try:
+            request_type, player_key, args = request
+            game, role = self._players[player_key]
+        except (TypeError, ValueError, KeyError):
+            return [0]
+        if request_type not in (2, 3, 4):
+            return [0]
+
+        with self._condition:
+            n_steps = game.n_steps
+            if game.game_stage != 2:
+                if request_type == 2:
+                    game.join(role)
+                elif request_type == 3:
+                    game.start(role, args)
+                else:
+                    game.submit_commands(role, args)
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: game.n_steps > n_steps or game.game_stage == 2,
+                                         timeout=self.player_timeout)
+            return game.response(role)
+
+    def send(self, dsl: main.DSL, decode_f=None, recorder: recording.Recorder = None):
+        '''`sender_f` for `main.send_join` etc. Goes through the same encoding
+        and decoding as a real request.
+        '''
+        request_body = main.make_request_body(dsl)
+        body = main.make_request_body(self.handle(main.parse_response_body(request_body)))
+        if recorder is not None:
+            recorder.record(request_body, body)
+        if decode_f is None:
+            decode_f = main.parse_response_body
+        return decode_f(body)
+
+
+def play_local_game(seed=0, max_n_ticks=main.MAX_N_ROUNDS,
+                    plan_f=main._plan_commands) -> (t.List[main.GameResponse], dict):
+    '''Plays both sides of one game in-process, in lockstep, with `plan_f`
+    (`main._plan_commands` by default) and the same request and response
+    encoding as over the network. Returns the last response of each role and
+    timing stats.
+    '''
+    game = Game(seed, max_n_ticks)
+    rngs = [np.random.default_rng([seed, role]) for role in (_ATTACKER, _DEFENDER)]
+
+    def request_args(request_body):
+        _, _, args = main.parse_response_body(request_body)
+        return args
+
+    def respond(role):
+        return main.decode_game_response(main.make_request_body(game.response(role)))
+
+    for role in (_ATTACKER, _DEFENDER):
+        game.join(role)
+    for role in (_ATTACKER, _DEFENDER):
+        game.start(role, request_args(main.make_request_body(
+            main._start_request_dsl(game.player_keys[role], *main.START_SHIP_PARAMS))))
+    responses = [respond(role) for role in (_ATTACKER, _DEFENDER)]
+    our_ship_ids = [main._extract_ship_ids(resp).get(resp.role) for resp in responses]
+    shots_done_counts = [0, 0]
+
+    plan_seconds = 0.0
+    start_time = time.perf_counter()
+    n_ticks = 0
+    while game.game_stage == 1:
+        for role in (_ATTACKER, _DEFENDER):
+            resp = responses[role]
+            plan_start_time = time.perf_counter()
+            cmds, shots_done_counts[role] = plan_f(resp.game_state, resp.role, our_ship_ids[role],
+                                                   rngs[role], shots_done_counts[role])
+            plan_seconds += time.perf_counter() - plan_start_time
+            request_body = main._commands_request_template(game.player_keys[role], cmds).bits
+            game.submit_commands(role, request_args(request_body))
+        responses = [respond(role) for role in (_ATTACKER, _DEFENDER)]
+        n_ticks += 1
+    seconds = time.perf_counter() - start_time
+
+    stats = {'n_ticks': n_ticks,
+             'seconds': seconds,
+             'ticks_per_second': n_ticks / seconds if seconds else float('inf'),
+             'plan_seconds': plan_seconds,
+             'n_ships_left': [sum(ship.role == role for ship in game.ships)
+                              for role in (_ATTACKER, _DEFENDER)]}
+    return responses, stats
+
+
+def play_side(player_key, sender_f, rng=None, plan_f=main._plan_commands) -> main.GameResponse:
+    '''Plays one side of a game with the blocking `main.send_join` etc., like `main.main`.
+    Returns the last response.
+    '''
+    if rng is None:
+        rng = main._make_rng()
+    join_resp = main.send_join(player_key, sender_f=sender_f)
+    resp = main.send_start(player_key, *main.START_SHIP_PARAMS, sender_f=sender_f)
+    our_ship_id = main._extract_ship_ids(resp).get(join_resp.role)
+    shots_done_count = 0
+    while resp.game_stage == 'already_started' and resp.game_state is not None:
+        cmds, shots_done_count = plan_f(resp.game_state, join_resp.role, our_ship_id,
+                                        rng, shots_done_count)
+        resp = main.send_commands(player_key, cmds, sender_f=sender_f)
+    return resp
+
+
+def record_game(attacker_path, defender_path, seed=0, max_n_ticks=main.MAX_N_ROUNDS):
+    '''Plays a game in-process, one thread per side, recording what each side
+    sends and receives like `BOT_RECORD_PATH` does for `main.py`.
+    '''
+    sim = Simulator(seed, max_n_ticks)
+    attacker_key, defender_key = main.send_create(sender_f=sim.send)
+    with recording.Recorder(attacker_path) as attacker_recorder, \
+            recording.Recorder(defender_path) as defender_recorder:
+        thread = threading.Thread(target=play_side, args=(
+            attacker_key, fnt.partial(sim.send, recorder=attacker_recorder),
+            np.random.default_rng([seed, _ATTACKER])))
+        thread.start()
+        play_side(defender_key, fnt.partial(sim.send, recorder=defender_recorder),
+                  np.random.default_rng([seed, _DEFENDER]))
+        thread.join()
+
+
+class _SimulatorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    simulator = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately; without this the body waits
+        # for the client's delayed ACK of the headers
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if self.path.split('?', 1)[0] != '/aliens/send':
+            self._respond(404, b'')
+            return
+        try:
+            request = main.parse_response_body(body)
+        except (AssertionError, ValueError):
+            self._respond(400, b'')
+            return
+        self._respond(200, main.make_request_body(self.simulator.handle(request)).encode())
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_server(simulator: Simulator, host='127.0.0.1', port=0) -> http.server.ThreadingHTTPServer:
+    '''HTTP server answering on `/aliens/send`, one thread per connection.
+    Call `serve_forever` on it; `port=0` picks a free port, see `server_port`.
+    '''
+    handler = type('SimulatorHandler', (_SimulatorHandler,), {'simulator': simulator})
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _serve(args):
+    simulator = Simulator(args.seed, args.max_n_ticks)
+    server = make_server(simulator, args.host, args.port)
+    server_url = f'http://{args.host}:{server.server_port}'
+    game = simulator.create_game()
+    print(f'serving on {server_url}, play a first game with:')
+    for player_key in game.player_keys:
+        print(f'    python app/main.py {server_url} {player_key}')
+    server.serve_forever()
+
+
+def _bench(args):
+    for i in range(args.games):
+        responses, stats = play_local_game(args.seed + i, args.max_n_ticks)
+        print(f'game {args.seed + i}: {stats["n_ticks"]} ticks in {stats["seconds"]:.3f} s, '
+              f'{stats["ticks_per_second"]:.0f} ticks/s, '
+              f'{stats["plan_seconds"] / max(stats["n_ticks"], 1) * 1e6:.0f} us planning per tick, '
+              f'ships left {stats["n_ships_left"]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local game server simulator.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-n-ticks', type=int, default=main.MAX_N_ROUNDS)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='serve on /aliens/send')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8001)
+    serve_parser.set_defaults(f=_serve)
+    bench_parser = subparsers.add_parser('bench', help='play games in-process and report throughput')
+    bench_parser.add_argument('--games', type=int, default=3)
+    bench_parser.set_defaults(f=_bench)
+    args = parser.parse_args()
+    args.f(args)
@@ -0,0 +1,239 @@
+import asyncio
+import functools as fnt
+import http.server
+import itertools as itt
+import threading
+import urllib.parse
+
+import pytest
+import requests
+
+from app import aio
+from app import main
+from app import tickprofile
+
+
+N_GAME_TICKS = 5
+
+
+def _ship_dsl(role, ship_id):
+    return [role, ship_id, main.Cons(48 - 96 * role, -48), main.Cons(0, 0),
+            [272, 16, 4, 32], 0, 64, 1]
+
+
+def _game_response_dsl(role, game_stage, game_tick):
+    return [1, game_stage, [256, role, [512, 1, 64], [16, 128], [272, 16, 4, 32]],
+            [game_tick, [16, 128], [[_ship_dsl(0, 0), []], [_ship_dsl(1, 1), []]]]]
+
+
+class _Game:
+    def __init__(self):
+        # Like the real server, nothing happens until both players did the same step,
+        # so playing the two sides one after the other would time out here.
+        self.barrier = threading.Barrier(2, timeout=5)
+        self.game_tick = 0
+
+
+class _GameHandler(http.server.BaseHTTPRequestHandler):
+    '''Keep-alive stand-in for the game server. Both players have to join, start
+    and send every tick's commands before either gets a response.
+    The game is finished after `N_GAME_TICKS` ticks.
+    '''
+    protocol_version = 'HTTP/1.1'
+    lock = threading.Lock()
+    player_keys = itt.count(1000)
+    games = {}
+    n_connections = 0
+    n_commands = 0
+    close_after_response = False
+    chunked = False
+
+    def setup(self):
+        type(self).n_connections += 1
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        if 'apiKey=bad' in self.path:
+            self._respond(403, b'')
+            return
+
+        request = main.parse_response_body(body)
+        self._respond(200, main.make_request_body(self._handle(request)).encode())
+
+    def _handle(self, request):
+        cls = type(self)
+        if request[0] == 1:
+            with cls.lock:
+                attacker_key, defender_key = next(cls.player_keys), next(cls.player_keys)
+                game = _Game()
+                cls.games[attacker_key] = (game, 0)
+                cls.games[defender_key] = (game, 1)
+            return [1, [[0, attacker_key], [1, defender_key]]]
+
+        if request[0] not in (2, 3, 4):
+            return [0]
+
+        game, role = cls.games[request[1]]
+        if request[0] == 2:
+            game.barrier.wait()
+            return [1, 0, [256, role, [512, 1, 64], [16, 128], None], None]
+        elif request[0] == 3:
+            game.barrier.wait()
+            return _game_response_dsl(role, 1, game.game_tick)
+        else:
+            with cls.lock:
+                cls.n_commands += 1
+            if game.barrier.wait() == 0:
+                game.game_tick += 1
+            game.barrier.wait()
+            return _game_response_dsl(role, 2 if game.game_tick >= N_GAME_TICKS else 1, game.game_tick)
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 7):
+                chunk = body[i:i + 7]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        if self.close_after_response:
+            # Without saying so, like a server dropping idle connections
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def game_server_url():
+    _GameHandler.games = {}
+    _GameHandler.n_connections = 0
+    _GameHandler.n_commands = 0
+    _GameHandler.close_after_response = False
+    _GameHandler.chunked = False
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _GameHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+async def _send_all(server_url, vals, **transport_kwargs):
+    async with aio.AsyncTransport(server_url, **transport_kwargs) as transport:
+        resps = [await aio.send_dsl(val, transport) for val in vals]
+        return resps, transport.stats()
+
+
+class TestAsyncTransport:
+    def test_connection_is_reused(self, game_server_url):
+        resps, stats = asyncio.run(_send_all(game_server_url, [[1, 0]] * 5))
+        assert [resp[0] for resp in resps] == [1] * 5
+        assert stats == {'n_requests': 5,
+                         'n_connections_opened': 1,
+                         'n_connections_reused': 4}
+        assert _GameHandler.n_connections == 1
+
+    def test_closed_connection_is_retried(self, game_server_url):
+        _GameHandler.close_after_response = True
+        resps, stats = asyncio.run(_send_all(game_server_url, [[1, 0]] * 3))
+        assert [resp[0] for resp in resps] == [1] * 3
+        assert stats['n_requests'] == 3
+        assert _GameHandler.n_connections == 3
+
+    def test_chunked_response(self, game_server_url):
+        _GameHandler.chunked = True
+        resps, _ = asyncio.run(_send_all(game_server_url, [[1, 0], [7]]))
+        assert resps[0][0] == 1
+        assert resps[1] == [0]
+
+    def test_error_status(self, game_server_url):
+        with pytest.raises(requests.HTTPError):
+            asyncio.run(_send_all(game_server_url, [[1, 0]], api_key='bad'))
+
+    def test_request_target(self):
+        transport = aio.AsyncTransport('https://example.com:8443', api_key='abc')
+        assert (transport.host, transport.port) == ('example.com', 8443)
+        assert transport.ssl is not None
+        assert urllib.parse.parse_qs(urllib.parse.urlsplit(transport.target).query) == {'apiKey': ['abc']}
+
+
+class TestPlayGames:
+    def test_play_both_sides(self, game_server_url):
+        async def play():
+            async with aio.AsyncTransport(game_server_url) as transport:
+                sender_f = fnt.partial(aio.send_dsl, transport=transport)
+                return await aio.play_both_sides(sender_f)
+
+        attacker_resp, defender_resp = asyncio.run(play())
+        assert (attacker_resp.role, defender_resp.role) == ('attacker', 'defender')
+        assert attacker_resp.game_stage == defender_resp.game_stage == 'finished'
+        assert attacker_resp.game_state.game_tick == N_GAME_TICKS
+        assert _GameHandler.n_commands == 2 * N_GAME_TICKS
+
+    def test_many_concurrent_games(self, game_server_url):
+        n_games = 24
+        results = asyncio.run(aio.play_many_games(game_server_url, n_games))
+        assert len(results) == n_games
+        for attacker_resp, defender_resp in results:
+            assert attacker_resp.game_stage == defender_resp.game_stage == 'finished'
+        assert len(_GameHandler.games) == 2 * n_games
+        assert _GameHandler.n_commands == 2 * n_games * N_GAME_TICKS
+
+    def test_profiler(self, game_server_url):
+        async def play():
+            async with aio.AsyncTransport(game_server_url) as transport:
+                sender_f = fnt.partial(aio.send_dsl, transport=transport)
+                attacker_key, defender_key = await aio.send_create(sender_f)
+                profiler = tickprofile.TickProfiler()
+                await asyncio.gather(aio.play_game(attacker_key, sender_f, profiler=profiler),
+                                     aio.play_game(defender_key, sender_f))
+                return profiler
+
+        profiler = asyncio.run(play())
+        assert len(profiler.ticks) == N_GAME_TICKS
+        assert [tick['n_ships'] for tick in profiler.ticks] == [2] * N_GAME_TICKS
+        assert profiler.summary()['network']['p50'] > 0
+        assert all('planner_nodes' in tick for tick in profiler.ticks)
+
+    def test_plans_like_main(self, game_server_url, monkeypatch):
+        plan_commands = main._plan_commands
+        calls = []
+
+        def spy(*args, **kwargs):
+            calls.append(kwargs)
+            return plan_commands(*args, **dict(kwargs, orbit_table=None, planning_pool=None))
+
+        monkeypatch.setattr(main, '_plan_commands', spy)
+        orbit_table, planning_pool = object(), object()
+        asyncio.run(aio.play_many_games(game_server_url, 1, orbit_table=orbit_table, planning_pool=planning_pool))
+        assert len(calls) == 2 * N_GAME_TICKS
+        for kwargs in calls:
+            assert kwargs['orbit_table'] is orbit_table and kwargs['planning_pool'] is planning_pool
+            assert kwargs['planner_stats'] is not None and kwargs['fallback_ship_ids'] is not None
+
+    def test_budget_from_env(self, game_server_url, monkeypatch):
+        plan_tick = main._plan_tick
+        budgets = []
+
+        def spy(*args, planning_budget, **kwargs):
+            budgets.append(planning_budget)
+            return plan_tick(*args, planning_budget=planning_budget, **kwargs)
+
+        monkeypatch.setattr(main, '_plan_tick', spy)
+        monkeypatch.setenv('BOT_TICK_BUDGET_SECONDS', '0.25')
+        asyncio.run(aio.play_many_games(game_server_url, 1))
+        assert budgets == [0.25] * (2 * N_GAME_TICKS)
+
+    def test_max_n_rounds(self, game_server_url):
+        results = asyncio.run(aio.play_many_games(game_server_url, 2, max_n_rounds=2))
+        for attacker_resp, defender_resp in results:
+            assert attacker_resp.game_stage == 'already_started'
+            assert attacker_resp.game_state.game_tick == 2
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from app import batch
+from app import main
+
+
+DSLS = [None,
+        0,
+        1,
+        -1,
+        [None],
+        [0],
+        [1, [2], [3]],
+        [[[1], 2], 3],
+        main.Cons(1, 2),
+        [0, main.Cons(-17, 300)],
+        [2, 1113939892088752268, None],
+        [2 ** 63, -(2 ** 64 - 1), 2 ** 64, -(2 ** 100)],
+        list(range(-300, 300))]
+
+
+def test_make_request_bodies():
+    assert batch.make_request_bodies(DSLS) == [main.make_request_body(dsl) for dsl in DSLS]
+
+
+def test_make_request_bodies_premodulated():
+    dsls = [[main._detonate_command_template(1)], [1]]
+    assert batch.make_request_bodies(dsls) == [main.make_request_body(dsl) for dsl in dsls]
+
+
+def test_parse_response_bodies():
+    bodies = [main.make_request_body(dsl) for dsl in DSLS]
+    assert batch.parse_response_bodies(bodies) == [main.parse_response_body(body) for body in bodies]
+
+
+@pytest.mark.parametrize('body', ['010', '0110111', '01101110101', '11', '1101', '0111111', '0'])
+def test_parse_truncated_or_trailing(body):
+    bodies = ['1101000', body, '010']
+    try:
+        expected = [main.parse_response_body(body) for body in bodies]
+    except ValueError:
+        with pytest.raises(ValueError):
+            batch.parse_response_bodies(bodies)
+    else:
+        assert batch.parse_response_bodies(bodies) == expected
+
+
+def test_parse_invalid_characters():
+    with pytest.raises(AssertionError):
+        batch.parse_response_bodies(['010', '0120'])
+
+
+def test_empty():
+    assert batch.parse_response_bodies([]) == []
+    assert batch.make_request_bodies([]) == []
+
+
+def test_random_round_trip():
+    rng = np.random.default_rng(0)
+    dsls = [[int(n) for n in rng.integers(-2 ** 40, 2 ** 40, size=rng.integers(0, 50))]
+            for _ in range(200)]
+    bodies = batch.make_request_bodies(dsls)
+    assert bodies == [main.make_request_body(dsl) for dsl in dsls]
+    assert batch.parse_response_bodies(bodies) == [main.parse_response_body(body) for body in bodies]
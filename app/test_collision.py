@@ -1,9 +1,134 @@
+import dis
+
+import numpy as np
 import pytest
 
 from app import collision
 
-@pytest.mark.parametrize('start,end,square_origin,square_rad,expected',
-                             [((5, 25), (0, -25), (0, 0), 18, True),
-                              ((25, 25), (25, -25), (0, 0), 18, False)])
+
+SEGMENT_SQUARE_CASES = [((5, 25), (0, -25), (0, 0), 18, True),
+                        ((25, 25), (25, -25), (0, 0), 18, False)]
+
+
+@pytest.mark.parametrize('start,end,square_origin,square_rad,expected', SEGMENT_SQUARE_CASES)
 def test_segment_crosses_square(start, end, square_origin, square_rad, expected):
     assert collision.segment_crosses_square(start, end, square_origin, square_rad) == expected
+
+
+def _random_segments(rng, n, low, high):
+    starts = rng.integers(low, high, size=(n, 2))
+    ends = rng.integers(low, high, size=(n, 2))
+    # No empty segments
+    ends[np.all(starts == ends, axis=-1), 0] += 1
+    return starts, ends
+
+
+def _scalar_matrix(starts, ends, square_origins, square_radii):
+    return np.array([[collision.segment_crosses_square(tuple(start), tuple(end), tuple(origin), radius)
+                      for origin, radius in zip(square_origins, square_radii)]
+                     for start, end in zip(starts.tolist(), ends.tolist())], dtype=bool).reshape(len(starts), -1)
+
+
+@pytest.mark.parametrize('start,end,square_origin,square_rad,expected', SEGMENT_SQUARE_CASES)
+def test_segments_cross_squares(start, end, square_origin, square_rad, expected):
+    assert collision.segments_cross_squares([start], [end], [square_origin], square_rad).tolist() == [[expected]]
+
+
+@pytest.mark.parametrize('low,high', [(-4, 5), (-40, 41)])
+def test_segments_cross_squares_matches_scalar(low, high):
+    # Small coordinates give many touching, colinear and overlapping edges
+    rng = np.random.default_rng(high)
+    starts, ends = _random_segments(rng, 300, low, high)
+    square_origins = rng.integers(low, high, size=(20, 2))
+    square_radii = rng.integers(1, high // 2 + 2, size=20)
+    crosses = collision.segments_cross_squares(starts, ends, square_origins, square_radii)
+    assert crosses.shape == (300, 20)
+    assert crosses.tolist() == _scalar_matrix(starts, ends, square_origins.tolist(), square_radii.tolist()).tolist()
+
+
+def test_segments_cross_squares_floats():
+    rng = np.random.default_rng(0)
+    starts = rng.uniform(-30, 30, size=(100, 2))
+    ends = rng.uniform(-30, 30, size=(100, 2))
+    square_origins = rng.uniform(-10, 10, size=(5, 2))
+    crosses = collision.segments_cross_squares(starts, ends, square_origins, 18)
+    assert crosses.tolist() == _scalar_matrix(starts, ends, square_origins.tolist(), [18] * 5).tolist()
+
+
+def test_segments_cross_squares_empty_segment():
+    with pytest.raises(Exception):
+        collision.segment_crosses_square((1, 1), (1, 1), (0, 0), 18)
+    with pytest.raises(ValueError):
+        collision.segments_cross_squares([(0, 30), (1, 1)], [(0, -30), (1, 1)], [(0, 0)], 18)
+
+
+def _random_ints(rng, n, size, low, high):
+    return rng.integers(low, high, size=(n, size)).tolist()
+
+
+@pytest.mark.parametrize('low,high', [(-3, 4), (-12, 13), (-1000, 1001)])
+def test_segment_intersection_code_matches_intersection(low, high):
+    rng = np.random.default_rng(high)
+    codes = set()
+    for coords in _random_ints(rng, 20000, 8, low, high):
+        if coords[0:2] == coords[2:4] or coords[4:6] == coords[6:8]:
+            continue
+        expected = collision.intersection(collision.line_segment(tuple(coords[0:2]), tuple(coords[2:4])),
+                                          collision.line_segment(tuple(coords[4:6]), tuple(coords[6:8])))
+        code = collision.segment_intersection_code(*coords)
+        assert code is collision.Intersection.from_result(expected)
+        codes.add(code)
+    if high < 5:
+        assert codes == set(collision.Intersection)
+
+
+@pytest.mark.parametrize('low,high', [(-4, 5), (-30, 31)])
+def test_segment_crosses_square_code_matches_scalar(low, high):
+    rng = np.random.default_rng(high)
+    for x0, y0, x1, y1, ox, oy, radius in _random_ints(rng, 20000, 7, low, high):
+        if (x0, y0) == (x1, y1):
+            continue
+        radius = abs(radius) // 2 + 1
+        assert collision.segment_crosses_square_code(x0, y0, x1, y1, ox, oy, radius) == \
+            collision.segment_crosses_square((x0, y0), (x1, y1), (ox, oy), radius)
+
+
+def _in_box(x, y, min_x, min_y, max_x, max_y):
+    return min_x <= x <= max_x and min_y <= y <= max_y
+
+
+@pytest.mark.parametrize('low,high', [(-4, 5), (-30, 31)])
+def test_segment_box_code_matches_scalar(low, high):
+    rng = np.random.default_rng(high)
+    codes = set()
+    for x0, y0, x1, y1, ox, oy, radius in _random_ints(rng, 20000, 7, low, high):
+        radius = abs(radius) // 2 + 1
+        box = (ox - radius, oy - radius, ox + radius, oy + radius)
+        code = collision.segment_box_code(x0, y0, x1, y1, *box)
+        codes.add(code)
+        crosses = (x0, y0) != (x1, y1) and collision.segment_crosses_square((x0, y0), (x1, y1), (ox, oy), radius)
+        # Along an edge, `segment_crosses_square` only counts segments covering all of it,
+        # but then one of the ends is on the edge
+        assert (code != collision.BoxHit.MISS) == (crosses or _in_box(x0, y0, *box) or _in_box(x1, y1, *box))
+        assert (code == collision.BoxHit.INSIDE) == (not crosses and _in_box(x0, y0, *box) and _in_box(x1, y1, *box)
+                                                     and ox - radius < x0 < ox + radius and oy - radius < y0 < oy + radius)
+    assert codes == set(collision.BoxHit)
+
+
+def test_segment_box_code_corners():
+    assert collision.segment_box_code(14, 21, 21, 14, -18, -18, 18, 18) == collision.BoxHit.EDGE
+    assert collision.segment_box_code(16, 22, 22, 16, -18, -18, 18, 18) == collision.BoxHit.MISS
+    assert collision.segment_box_code(17, 19, 19, 17, -18, -18, 18, 18) == collision.BoxHit.EDGE
+    assert collision.segment_box_code(0, 0, 3, 3, -18, -18, 18, 18) == collision.BoxHit.INSIDE
+    # An empty segment is a point
+    assert collision.segment_box_code(5, 5, 5, 5, -18, -18, 18, 18) == collision.BoxHit.INSIDE
+    assert collision.segment_box_code(18, 5, 18, 5, -18, -18, 18, 18) == collision.BoxHit.EDGE
+    assert collision.segment_box_code(19, 5, 19, 5, -18, -18, 18, 18) == collision.BoxHit.MISS
+
+
+@pytest.mark.parametrize('kernel', [collision.segment_intersection_code, collision.segment_crosses_square_code,
+                                    collision.segment_box_code])
+def test_kernels_build_no_containers(kernel):
+    built = [instruction.opname for instruction in dis.get_instructions(kernel)
+             if instruction.opname.startswith('BUILD_')]
+    assert built == []
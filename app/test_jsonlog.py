@@ -0,0 +1,87 @@
+import io
+import json
+
+from app import jsonlog
+from app import main
+
+
+def _lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestLogger:
+    def test_levels(self):
+        stream = io.StringIO()
+        logger = jsonlog.Logger(stream, level=jsonlog.INFO)
+        logger.debug('hidden')
+        logger.info('shown', {'a': 1})
+        logger.error('also shown')
+        lines = _lines(stream)
+        assert [(line['level'], line['msg']) for line in lines] == [('info', 'shown'), ('error', 'also shown')]
+        assert lines[0]['a'] == 1
+        assert logger.enabled(jsonlog.WARNING) and not logger.enabled(jsonlog.DEBUG)
+
+    def test_quiet(self):
+        stream = io.StringIO()
+        logger = jsonlog.Logger(stream, level=jsonlog.QUIET)
+        logger.error('hidden')
+        assert stream.getvalue() == ''
+
+    def test_lazy_data(self):
+        calls = []
+
+        def data():
+            calls.append(1)
+            return {'big': list(range(3))}
+
+        stream = io.StringIO()
+        logger = jsonlog.Logger(stream, level=jsonlog.INFO)
+        logger.debug('hidden', data)
+        assert calls == []
+        logger.info('shown', data)
+        assert calls == [1]
+        assert _lines(stream)[0]['big'] == [0, 1, 2]
+
+    def test_game_values(self):
+        stream = io.StringIO()
+        logger = jsonlog.Logger(stream)
+        resp = main.GameResponse(1, 'already_started', None,
+                                 main.GameState(3, None, [main.ShipAndCommands(
+                                     main.Ship('attacker', 0, (1, 2), (0, -1), [1, 0, 0, 1], 0, 64, 1),
+                                     [main.Command('accelerate', [(1, 1)])])]))
+        logger.info('values', {'cons': main.Cons(1, main.Cons(2, None)),
+                               'modulated': main.Modulated('1101000'),
+                               'resp': resp,
+                               'data': object()})
+        line = _lines(stream)[0]
+        assert line['cons'] == [1, [2, None]]
+        assert line['modulated'] == ['1101000']
+        ship = line['resp']['game_state']['ships_and_commands'][0]['ship']
+        assert ship['position'] == [1, 2]
+        assert line['resp']['game_state']['ships_and_commands'][0]['applied_commands'][0]['command'] == 'accelerate'
+        assert line['data'].startswith('<object')
+
+    def test_background_writer(self):
+        stream = io.StringIO()
+        logger = jsonlog.Logger(stream, level=jsonlog.DEBUG, background=True)
+        for i in range(100):
+            logger.debug('tick', lambda i=i: {'i': i})
+        logger.close()
+        assert [line['i'] for line in _lines(stream)] == list(range(100))
+        # Synchronous after closing
+        logger.info('after')
+        assert _lines(stream)[-1]['msg'] == 'after'
+
+    def test_from_env(self):
+        logger = jsonlog.from_env({'BOT_LOG_LEVEL': 'QUIET'})
+        assert logger.level == jsonlog.QUIET
+        logger = jsonlog.from_env({'BOT_LOG_BACKGROUND': '1'})
+        assert logger.level == jsonlog.INFO
+        logger.close()
+
+    def test_from_env_unknown_level(self):
+        stream = io.StringIO()
+        logger = jsonlog.from_env({'BOT_LOG_LEVEL': 'verbose'}, stream=stream)
+        assert logger.level == jsonlog.INFO
+        [line] = _lines(stream)
+        assert (line['level'], line['BOT_LOG_LEVEL'], line['levels']) == ('warning', 'verbose', list(jsonlog.LEVELS))
@@ -1,6 +1,18 @@
+import concurrent.futures as cf
+import http.server
+import math
+import os
+import threading
+import time
+
+import numpy as np
 import pytest
 
+from app import collision
+from app import fleets
 from app import main
+from app import recording
+from app import tickprofile
 
 
 class TestDemodulateBits:
@@ -27,6 +39,13 @@ class TestDemodulateBits:
     def test_nil(self, bits, rest_bits):
         assert main.demodulate_bits(bits) == (None, rest_bits)
 
+    @pytest.mark.parametrize('bits', ['0110000101', b'0110000101', [0, 1, 1, 0, 0, 0, 0, 1, 0, 1],
+                                      [False, True, True, False, False, False, False, True, False, True]])
+    def test_rest_is_ints(self, bits):
+        num, rest_bits = main.demodulate_bits(bits)
+        assert (num, rest_bits) == (1, [0, 1])
+        assert all(type(bit) is int for bit in rest_bits)
+
     @pytest.mark.parametrize('bits,val,rest_bits',
                              [([1, 1, 0, 0, 0, 0], main.Cons(None, None), []),
                               ([1, 1, 0, 1, 0, 0, 0], main.Cons(0, None), []),
@@ -81,6 +100,17 @@ class TestDSL:
     def test_dsl_round_trip(self, dsl):
         assert main.parse_response_body(main.make_request_body(dsl)) == dsl
 
+    def test_parse_bytes(self):
+        assert main.parse_response_body(b'1101000') == [0]
+
+    def test_long_list_round_trip(self):
+        dsl = list(range(-200, 200))
+        assert main.parse_response_body(main.make_request_body(dsl)) == dsl
+
+    def test_big_number_round_trip(self):
+        dsl = [2, 1113939892088752268, None]
+        assert main.parse_response_body(main.make_request_body(dsl)) == dsl
+
 
 @pytest.mark.parametrize('tree,dsl',
                          [(main.Cons(0, None), [0]),
@@ -95,3 +125,694 @@ class TestDSL:
                           ])
 def test_cons_tree_to_list(tree, dsl):
     assert main.cons_tree_to_list(tree) == dsl
+
+
+def _nested_dsl(depth):
+    dsl = [0]
+    for i in range(1, depth):
+        dsl = [dsl, i]
+    return dsl
+
+
+def _nested_depth(dsl):
+    # Avoids `==` on deeply nested lists, which recurses.
+    depth = 0
+    while isinstance(dsl, list):
+        assert len(dsl) == 2 or dsl == [0]
+        dsl = dsl[0]
+        depth += 1
+    return depth
+
+
+class TestLargeValues:
+    def test_long_list_round_trip(self):
+        dsl = list(range(-50000, 50000))
+        assert main.parse_response_body(main.make_request_body(dsl)) == dsl
+
+    def test_long_nested_list_round_trip(self):
+        dsl = [[i, main.Cons(i, -i)] for i in range(100000)]
+        assert main.parse_response_body(main.make_request_body(dsl)) == [[i, [i, -i]] for i in range(100000)]
+
+    def test_deep_nesting_round_trip(self):
+        body = main.make_request_body(_nested_dsl(10000))
+        parsed = main.parse_response_body(body)
+        assert _nested_depth(parsed) == 10000
+        assert main.make_request_body(parsed) == body
+
+    def test_deep_cons_modulate_demodulate(self):
+        tree = None
+        for i in range(10000):
+            tree = main.Cons(tree, i)
+        bits = main.modulate(tree)
+        demodulated, rest_bits = main.demodulate_bits(bits + [0, 1])
+        assert rest_bits == [0, 1]
+        for i in reversed(range(10000)):
+            assert demodulated.cdr == i
+            demodulated = demodulated.car
+        assert demodulated is None
+
+
+class TestStreamingDemodulator:
+    @pytest.mark.parametrize('dsl', [None,
+                                     0,
+                                     -17,
+                                     [1, [2], [3]],
+                                     [[[1], 2], 3],
+                                     [2, 1113939892088752268, None],
+                                     list(range(-300, 300))])
+    @pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 4096])
+    def test_chunked_matches_parse_response_body(self, dsl, chunk_size):
+        body = main.make_request_body(dsl)
+        chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        assert main.parse_response_stream(chunks) == (main.parse_response_body(body), 0)
+
+    def test_done_at_last_bit(self):
+        body = main.make_request_body([1, 2])
+        demodulator = main.StreamingDemodulator()
+        assert [demodulator.feed(bit) for bit in body] == [False] * (len(body) - 1) + [True]
+        assert demodulator.close() == main.Cons(1, main.Cons(2, None))
+
+    def test_trailing_bits(self):
+        body = main.make_request_body([1, 2])
+        chunks = [body[:5], body[5:].encode() + b'0101', b'11']
+        assert main.parse_response_stream(chunks) == ([1, 2], 6)
+
+    def test_missing_number_bits_are_zeros(self):
+        assert main.parse_response_stream(['0110', '111']) == (14, 0)
+
+    @pytest.mark.parametrize('chunks', [[''], ['0'], ['1101000'[:5]], ['0120']])
+    def test_invalid(self, chunks):
+        with pytest.raises(ValueError):
+            main.parse_response_stream(chunks)
+
+
+class TestTemplates:
+    @pytest.mark.parametrize('ship_id', [0, 1, 17])
+    @pytest.mark.parametrize('x,y', [(-1, -1), (0, 1), (1, 0)])
+    def test_accelerate(self, ship_id, x, y):
+        vector = main._make_acc_vector(x, y)
+        assert (main._accelerate_command_template(ship_id, vector).bits ==
+                main.make_request_body(main._accelerate_command_dsl(ship_id, vector)))
+
+    def test_detonate(self):
+        assert (main._detonate_command_template(3).bits ==
+                main.make_request_body(main._detonate_command_dsl(3)))
+
+    def test_shoot(self):
+        target = main.Cons(-48, 120)
+        assert (main._shoot_command_template(1, target, 7).bits ==
+                main.make_request_body(main._shoot_command_dsl(1, target, 7)))
+
+    def test_fork(self):
+        assert (main._fork_command_template(1, 136, 0, 0, 1).bits ==
+                main.make_request_body(main._fork_command_dsl(1, 136, 0, 0, 1)))
+
+    @pytest.mark.parametrize('commands', [[],
+                                          [main._detonate_command_dsl(0)],
+                                          [main._detonate_command_dsl(0),
+                                           main._fork_command_dsl(0, 1, 0, 0, 1)]])
+    def test_commands_request(self, commands):
+        player_key = 1113939892088752268
+        expected = main.make_request_body(main._commands_request_dsl(player_key, commands))
+        assert main._commands_request_template(player_key, commands).bits == expected
+        premodulated = [main.Modulated(main.make_request_body(cmd)) for cmd in commands]
+        assert main._commands_request_template(player_key, premodulated).bits == expected
+        assert main.make_request_body(main._commands_request_dsl(player_key, premodulated)) == expected
+
+    def test_caches_are_bounded(self):
+        assert main._modulated_int.cache_info().maxsize == main.NUMBER_CACHE_SIZE
+        assert main._accelerate_command_template.cache_info().maxsize == main.TEMPLATE_CACHE_SIZE
+
+    def test_modulated_repr(self):
+        detonate = main._detonate_command_template(3)
+        assert repr(detonate) == f"Modulated(bits='{main.make_request_body([1, 3])}')"
+        assert detonate.decoded() == [1, 3]
+        # Fragments have a repr too, but no value
+        assert repr(main._CONS_BITS) == "Modulated(bits='11')"
+        with pytest.raises(ValueError):
+            main._CONS_BITS.decoded()
+
+
+class TestCons:
+    def test_namedtuple_compatible(self):
+        cons = main.Cons(1, main.Cons(2, None))
+        car, cdr = cons
+        assert (car, cdr) == (1, main.Cons(2, None))
+        assert cons[0] == cons.car == 1
+        assert cons[1] == cons.cdr
+        assert len(cons) == 2
+        assert main.Cons(1, 2) == (1, 2)
+        assert (1, 2) == main.Cons(1, 2)
+        assert main.Cons(1, 2) != main.Cons(2, 1)
+        assert main.Cons(1, 2) != [1, 2]
+        assert hash(main.Cons(1, 2)) == hash((1, 2))
+        assert main.Cons._make([1, 2]) == main.Cons(1, 2)
+        assert repr(cons) == 'Cons(car=1, cdr=Cons(car=2, cdr=None))'
+
+    def test_deep_equality(self):
+        a = b = None
+        for i in range(10000):
+            a = main.Cons(i, a)
+            b = main.Cons(i, b)
+        assert a == b
+        assert a != main.Cons(-1, b.cdr)
+
+
+@pytest.mark.parametrize('dsl', [[main.Cons(1, 2)],
+                                 [[main.Cons(1, None)], main.Cons(main.Cons(1, 2), 3)],
+                                 main.Cons(main.Cons(None, None), main.Cons(5, [6]))])
+def test_parse_response_body_matches_cons_tree(dsl):
+    body = main.make_request_body(dsl)
+    tree, _ = main.demodulate_bits(body)
+    assert main.parse_response_body(body) == main.cons_tree_to_list(tree)
+
+
+def _ship_and_commands_dsl(ship_id, cmds):
+    return [[ship_id % 2, ship_id, main.Cons(48 - ship_id, -48), main.Cons(0, ship_id % 3 - 1),
+             [128, 0, 8, 1], 0, 64, 1],
+            cmds]
+
+
+GAME_RESPONSE_DSLS = [
+    [0],
+    [1, 0, [256, 1, [512, 1, 64], [16, 128], None], None],
+    [1, 1, [256, 0, [512, 1, 64], [16, 128], [272, 16, 4, 32]],
+     [0, [16, 128], [_ship_and_commands_dsl(0, None), _ship_and_commands_dsl(1, [])]]],
+    [1, 1, [256, 0, [512, 1, 64], [16, 128], [272, 16, 4, 32]],
+     [42, [16, 128], [_ship_and_commands_dsl(i, [[0, main.Cons(1, -1)],
+                                                 [1],
+                                                 [2, main.Cons(-48, 7), 10, 20, 4],
+                                                 [3, [1, 0, 0, 1]],
+                                                 [9, 1]])
+                      for i in range(60)]]],
+    [1, 2, [256, 1, None, None, None], [384, None, None]],
+]
+
+
+class TestGameResponse:
+    @pytest.mark.parametrize('dsl', GAME_RESPONSE_DSLS)
+    def test_decode_matches_dsl_path(self, dsl):
+        body = main.make_request_body(dsl)
+        assert main.decode_game_response(body) == main._parse_game_response(main.parse_response_body(body))
+
+    def test_strict_decoder_is_used(self):
+        body = main.make_request_body(GAME_RESPONSE_DSLS[3])
+        resp = main._decode_game_response_strict(body)
+        ship_and_commands = resp.game_state.ships_and_commands[1]
+        assert resp.role == 'attacker'
+        assert ship_and_commands.ship.position == (47, -48)
+        assert ship_and_commands.ship.velocity == (0, 0)
+        assert ship_and_commands.applied_commands[0] == main.Command('accelerate', [(1, -1)])
+        assert ship_and_commands.applied_commands[2] == main.Command('shoot', [(-48, 7), 10, 20, 4])
+        assert ship_and_commands.applied_commands[4] == main.Command('unknown', [1])
+
+    def test_unexpected_shape_falls_back(self):
+        # Position as a list instead of a vector
+        dsl = [1, 1, None, [0, None, [[[0, 0, [1, 2], [0, 0], None, 0, 0, 0], None]]]]
+        body = main.make_request_body(dsl)
+        with pytest.raises(ValueError):
+            main._decode_game_response_strict(body)
+        assert main.decode_game_response(body).game_state.ships_and_commands[0].ship.position == (1, 2)
+
+    def test_failure(self):
+        assert main.decode_game_response('1101000') == main.GameResponse(success=False)
+        assert main.decode_game_response('1101000').role is None
+
+    def test_invalid_success(self):
+        with pytest.raises(AssertionError):
+            main.decode_game_response(main.make_request_body([2, 1, None, None]))
+
+
+class _EchoHandler(http.server.BaseHTTPRequestHandler):
+    '''Keep-alive stand-in for the server that echoes the request body back.'''
+    protocol_version = 'HTTP/1.1'
+    n_connections = 0
+
+    def setup(self):
+        type(self).n_connections += 1
+        super().setup()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def echo_server_url():
+    _EchoHandler.n_connections = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _EchoHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestTransport:
+    def test_connection_is_reused(self, echo_server_url):
+        with main.Transport(echo_server_url) as transport:
+            for i in range(5):
+                assert main.send_dsl([i, [i]], echo_server_url, transport=transport) == [i, [i]]
+            assert main.send_dsl([0], echo_server_url, transport=transport,
+                                 decode_f=main.decode_game_response) == main.GameResponse(success=False)
+            stats = transport.stats()
+
+        assert stats == {'n_requests': 6,
+                         'n_connections_opened': 1,
+                         'n_connections_reused': 5}
+        assert _EchoHandler.n_connections == 1
+
+    def test_profiler(self, echo_server_url):
+        profiler = tickprofile.TickProfiler()
+        with main.Transport(echo_server_url) as transport:
+            main.send_dsl([1, [2]], echo_server_url, transport=transport, profiler=profiler)
+            main.send_dsl([0], echo_server_url, transport=transport, profiler=profiler,
+                          decode_f=main.decode_game_response)
+        tick = profiler.end_tick()
+        n_bits = len(main.make_request_body([1, [2]])) + len(main.make_request_body([0]))
+        assert tick['request_bits'] == tick['response_bits'] == n_bits
+        assert all(tick[phase] > 0 for phase in ['encode', 'network', 'decode'])
+
+    def test_profiler_counts_body_as_decode(self):
+        class SlowBodyResponse:
+            status_code = 200
+
+            def raise_for_status(self):
+                pass
+
+            @property
+            def content(self):
+                time.sleep(0.05)
+                return main.make_request_body([0]).encode()
+
+        class SlowBodyTransport:
+            def post(self, data):
+                return SlowBodyResponse()
+
+        profiler = tickprofile.TickProfiler()
+        main.send_dsl([0], None, transport=SlowBodyTransport(), profiler=profiler,
+                      decode_f=main.decode_game_response)
+        tick = profiler.end_tick()
+        assert tick['decode'] >= 0.05 > tick['network']
+
+    def test_recorder(self, echo_server_url, tmp_path):
+        with recording.Recorder(tmp_path / 'game.rec') as recorder:
+            main.send_dsl([1, [2]], echo_server_url, recorder=recorder)
+            main.send_dsl([0], echo_server_url, recorder=recorder, decode_f=main.decode_game_response)
+        with recording.Recording(tmp_path / 'game.rec') as rec:
+            assert [(request, response) for _, request, response in rec] == \
+                [(main.make_request_body([1, [2]]),) * 2, (main.make_request_body([0]),) * 2]
+
+    def test_without_transport_connects_every_time(self, echo_server_url):
+        for i in range(3):
+            main.send_dsl([i], echo_server_url)
+        assert _EchoHandler.n_connections == 3
+
+
+def _game_state(*ships):
+    return main.GameState(1, None, [main.ShipAndCommands(ship, []) for ship in ships])
+
+
+def _test_ship(role, ship_id, position, velocity=(0, 0), params=(100, 0, 0, 4)):
+    return main.Ship(role, ship_id, position, velocity, list(params), 0, 64, 1)
+
+
+class TestPlanCommands:
+    def test_without_deadline(self):
+        game_state = _game_state(_test_ship('attacker', 0, (20, 20)), _test_ship('defender', 1, (-60, -60)))
+        fallback_ship_ids = []
+        cmds, _ = main._plan_commands(game_state, 'attacker', 0, main._make_rng(), 0,
+                                      fallback_ship_ids=fallback_ship_ids)
+        assert main._accelerate_command_template(0, main.Cons(-1, -1)) in cmds
+        assert fallback_ship_ids == []
+
+    def test_past_deadline_falls_back(self):
+        game_state = _game_state(_test_ship('attacker', 0, (20, 20)),
+                                 _test_ship('attacker', 2, (-80, 0), velocity=(0, 8)),
+                                 _test_ship('attacker', 3, (0, 20), velocity=(0, -2)),
+                                 _test_ship('defender', 1, (-60, -60)))
+        fallback_ship_ids = []
+        cmds, shots_done_count = main._plan_commands(game_state, 'attacker', 0, main._make_rng(), 0,
+                                                     deadline=time.perf_counter() - 1,
+                                                     fallback_ship_ids=fallback_ship_ids)
+        assert fallback_ship_ids == [0, 2, 3]
+        assert shots_done_count == 0
+        # Only ship 3 would crash into the planet in the next tick
+        assert cmds == [main._accelerate_command_template(3, main.Cons(-1, -1))]
+
+
+class TestTickPlanningBudget:
+    @pytest.mark.parametrize('environ,budget', [({}, main.TICK_PLANNING_BUDGET_SECONDS),
+                                                ({'BOT_TICK_BUDGET_SECONDS': ''}, main.TICK_PLANNING_BUDGET_SECONDS),
+                                                ({'BOT_TICK_BUDGET_SECONDS': '0.25'}, 0.25),
+                                                ({'BOT_TICK_BUDGET_SECONDS': '2'}, 2.0)])
+    def test_from_env(self, environ, budget):
+        assert main._tick_planning_budget(environ) == budget
+
+    @pytest.mark.parametrize('value', ['soon', '0', '-1', 'inf', 'nan'])
+    def test_invalid_falls_back(self, value):
+        assert main._tick_planning_budget({'BOT_TICK_BUDGET_SECONDS': value}) == main.TICK_PLANNING_BUDGET_SECONDS
+
+
+def _random_ships(n_ships, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = rng.integers(-60, 61, size=(n_ships, 2)).tolist()
+    velocities = rng.integers(-9, 10, size=(n_ships, 2)).tolist()
+    # Edge cases: the planet's edge, diagonals, the origin
+    positions[:6] = [[18, 18], [19, -18], [-19, 19], [30, -30], [0, 0], [0, 25]]
+    return positions, velocities
+
+
+class TestBatchedTrajectories:
+    def test_gravity(self):
+        positions = [[x, y] for x in range(-3, 4) for y in range(-3, 4)]
+        assert main._gravity_batch(np.array(positions)).tolist() == \
+            [main._calculate_gravity(position) for position in positions]
+
+    def test_points_in_planet(self):
+        points = [[x, y] for x in range(-20, 21, 1) for y in (-19, -18, 0, 18, 19)]
+        assert main._points_in_planet_batch(np.array(points)).tolist() == \
+            [main._point_in_planet(point) for point in points]
+
+    def test_matches_scalar(self):
+        positions, velocities = _random_ships(300)
+        trajectories, hits = main._predicted_trajectories(positions, velocities, n=25)
+        assert trajectories.shape == (300, 25, 2)
+        for position, velocity, trajectory, hit in zip(positions, velocities, trajectories.tolist(), hits.tolist()):
+            expected = main._predicted_trajectory(position, velocity, n=25)
+            assert trajectory == expected
+            assert hit == main._trajectory_hits_planet(expected)
+
+    def test_candidates_match_scalar(self):
+        positions, velocities = _random_ships(40, seed=1)
+        trajectories, hits = main._candidate_trajectories(positions, velocities, n=10)
+        assert trajectories.shape == (40, 9, 10, 2)
+        assert hits.shape == (40, 9)
+        for ship_i, (position, velocity) in enumerate(zip(positions, velocities)):
+            for acc_i, (acc_x, acc_y) in enumerate(main.ACCELERATIONS.tolist()):
+                expected = main._predicted_trajectory(position, [velocity[0] - acc_x, velocity[1] - acc_y], n=10)
+                assert trajectories[ship_i, acc_i].tolist() == expected
+                assert hits[ship_i, acc_i] == main._trajectory_hits_planet(expected)
+
+    def test_plan_commands_same_with_batching(self, monkeypatch):
+        positions, velocities = _random_ships(40, seed=2)
+        ships = [_test_ship('attacker', i, tuple(position), tuple(velocity), params=(100, 0, 0, 1))
+                 for i, (position, velocity) in enumerate(zip(positions, velocities))]
+        game_state = _game_state(*ships, _test_ship('defender', 99, (-60, -60)))
+
+        def plan():
+            return main._plan_commands(game_state, 'attacker', 0, np.random.default_rng(0), 0)
+
+        monkeypatch.setattr(main, 'BATCH_PREDICTION_MIN_SHIPS', 1000)
+        unbatched = plan()
+        monkeypatch.setattr(main, 'BATCH_PREDICTION_MIN_SHIPS', 1)
+        assert plan() == unbatched
+
+
+class TestTrajectoryCache:
+    def test_matches_predicted_trajectory(self):
+        positions, velocities = _random_ships(100, seed=3)
+        for position, velocity in zip(positions, velocities):
+            for n in (1, 2, 20):
+                trajectory, hits = main._cached_trajectory(tuple(position), tuple(velocity), n)
+                expected = main._predicted_trajectory(position, velocity, n)
+                assert [list(point) for point in trajectory] == expected
+                assert hits == main._path_hits_planet(position, expected)
+
+    def test_hits(self):
+        before = main._trajectory_cache_stats()
+        main._cached_trajectory((101, -55), (3, 4), 20)
+        main._cached_trajectory((101, -55), (3, 4), 20)
+        after = main._trajectory_cache_stats()
+        assert after['n_hits'] - before['n_hits'] >= 1
+        assert after['n_misses'] - before['n_misses'] <= 1
+
+    @pytest.mark.parametrize('n', [1, 2, 20])
+    def test_coasting_ship_extends_previous_prediction(self, n):
+        position, velocity = [70, -3], [0, 7]
+        before = main._trajectory_cache_stats()
+        for _ in range(30):
+            trajectory, hits = main._cached_trajectory(tuple(position), tuple(velocity), n)
+            expected = main._predicted_trajectory(position, velocity, n)
+            assert [list(point) for point in trajectory] == expected
+            assert hits == main._path_hits_planet(position, expected)
+            velocity = main._next_velocity(position, velocity)
+            position = main._next_position(position, velocity)
+        after = main._trajectory_cache_stats()
+        assert after['n_extended'] - before['n_extended'] >= 29 - (after['n_hits'] - before['n_hits'])
+
+    def test_bounded(self):
+        for i in range(main.TRAJECTORY_CACHE_SIZE + 10):
+            main._cached_trajectory((i, 200), (0, 0), 1)
+        assert main._trajectory_cache_stats()['size'] <= main.TRAJECTORY_CACHE_SIZE
+        assert len(main._coasting_predictions) <= main.TRAJECTORY_CACHE_SIZE
+
+    def test_reset(self):
+        position, velocity = (70, -3), (0, 7)
+        main._cached_trajectory(position, velocity, 20)
+        main._reset_trajectory_cache()
+        assert len(main._coasting_predictions) == 0
+        assert main._trajectory_cache_stats() == {'n_hits': 0, 'n_misses': 0, 'n_extended': 0, 'size': 0}
+        main._cached_trajectory(position, velocity, 20)
+        assert main._trajectory_cache_stats()['n_misses'] == 1
+
+
+class TestImpactSimulation:
+    def _expected(self, position, velocity):
+        trajectory = main._predicted_trajectory(position, velocity, main.IMPACT_HORIZON)
+        return next((step for step, point in enumerate(trajectory, 1) if main._point_in_planet(point)),
+                    main.NO_IMPACT)
+
+    def test_matches_predicted_trajectory(self):
+        positions, velocities = _random_ships(200, seed=5)
+        # Outside the playfield too
+        positions[6:9] = [[main.PLAYFIELD_RADIUS + 1, 0], [-140, 3], [-main.PLAYFIELD_RADIUS, main.PLAYFIELD_RADIUS]]
+        steps = main._steps_until_impact_simulated(positions, velocities)
+        assert steps.tolist() == [self._expected(position, velocity)
+                                  for position, velocity in zip(positions, velocities)]
+
+    def test_leave_playfield(self):
+        steps = main._steps_until_impact_simulated([[20, 20], [main.PLAYFIELD_RADIUS, 0]], [[0, 0], [3, 0]],
+                                                   leave_playfield=True)
+        assert steps.tolist() == [3, 1]
+
+
+def _planner(position, velocity, fuel):
+    if not main._cached_trajectory(tuple(position), tuple(velocity))[1]:
+        return None
+    return main._planned_acceleration(position, velocity, max_fuel=fuel)
+
+
+class TestPlanner:
+    def test_coasts_when_safe(self):
+        stats = {}
+        assert main._planned_acceleration([60, -10], [0, 5], max_fuel=10, stats=stats) is None
+        assert stats['n_nodes'] == 1
+
+    def test_avoids_planet(self):
+        for position, velocity in [([20, 20], [0, 0]), ([0, 40], [0, -3]), ([100, 0], [0, 0])]:
+            assert main._cached_trajectory(tuple(position), tuple(velocity))[1]
+            assert fleets.fly(position, velocity, _planner)[0]
+
+    def test_cheaper_than_heuristic(self):
+        ships = [([20, 20], [0, 0]), ([0, 40], [0, -3]), ([-50, 30], [2, 0]), ([45, 45], [-3, -3]),
+                 ([30, 0], [0, 3])]
+        planned = [fleets.fly(position, velocity, _planner, n_ticks=64) for position, velocity in ships]
+        heuristic = [fleets.fly(position, velocity, lambda p, v, fuel: main._acceleration_heuristic(p, v), n_ticks=64)
+                     for position, velocity in ships]
+        assert all(survived for survived, _ in planned)
+        assert sum(fuel for _, fuel in planned) < sum(fuel for _, fuel in heuristic)
+
+    def test_budget(self):
+        stats = {}
+        main._planned_acceleration([20, 20], [0, 0], max_fuel=10, max_nodes=5, stats=stats)
+        assert stats['n_nodes'] == 5
+        # Out of time: push away from gravity
+        stats = {}
+        assert main._planned_acceleration([20, 20], [0, 0], max_fuel=10, stats=stats,
+                                          deadline=time.perf_counter() - 1) == [-1, -1]
+        assert stats['n_nodes'] == 0
+
+    def test_no_fuel(self):
+        assert main._planned_acceleration([20, 20], [0, 0], max_fuel=0) is None
+
+    def test_plan_commands_reports_nodes(self):
+        game_state = _game_state(_test_ship('attacker', 0, (20, 20)), _test_ship('defender', 1, (-60, -60)))
+        planner_stats = {'n_nodes': 0}
+        main._plan_commands(game_state, 'attacker', 0, main._make_rng(), 0, planner_stats=planner_stats)
+        assert planner_stats['n_nodes'] > 0
+
+
+@pytest.fixture(scope='module')
+def planning_pool():
+    with main._PlanningPool(2) as pool:
+        yield pool
+
+
+class TestPlanningPool:
+    def test_same_commands_as_serial(self, planning_pool):
+        for n_ships in (main.PLANNING_POOL_MIN_SHIPS - 1, main.PLANNING_POOL_MIN_SHIPS, 100):
+            game_state = fleets.fleet_game_state(n_ships)
+            serial_stats, pooled_stats = {'n_nodes': 0}, {'n_nodes': 0}
+            serial = main._plan_commands(game_state, 'attacker', fleets.FIRST_SHIP_ID, np.random.default_rng(n_ships), 0,
+                                         planner_stats=serial_stats)
+            pooled = main._plan_commands(game_state, 'attacker', fleets.FIRST_SHIP_ID, np.random.default_rng(n_ships), 0,
+                                         planner_stats=pooled_stats, planning_pool=planning_pool)
+            assert pooled == serial
+            assert pooled_stats == serial_stats
+            assert serial_stats['n_nodes'] > 0
+            assert main._detonate_command_template(fleets.FIRST_SHIP_ID + n_ships) in serial[0]
+
+    def test_past_deadline_falls_back(self, planning_pool):
+        game_state = fleets.fleet_game_state(main.PLANNING_POOL_MIN_SHIPS)
+        planner_stats = {'n_nodes': 0}
+        fallback_ship_ids = []
+        cmds, _ = main._plan_commands(game_state, 'attacker', fleets.FIRST_SHIP_ID, main._make_rng(), 0,
+                                      deadline=time.perf_counter() - 1, fallback_ship_ids=fallback_ship_ids,
+                                      planner_stats=planner_stats, planning_pool=planning_pool)
+        assert fallback_ship_ids == list(range(fleets.FIRST_SHIP_ID, fleets.FIRST_SHIP_ID + main.PLANNING_POOL_MIN_SHIPS))
+        assert planner_stats == {'n_nodes': 0}
+        assert main._detonate_command_template(fleets.FIRST_SHIP_ID + main.PLANNING_POOL_MIN_SHIPS) in cmds
+
+    def test_accelerations_by_ship_id(self, planning_pool):
+        ships = [ship_and_command.ship for ship_and_command in fleets.fleet_game_state(10).ships_and_commands][1:-1]
+        accelerations = planning_pool.accelerations(ships)
+        assert list(accelerations) == [ship.ship_id for ship in ships if ship.ship_id % 2 == 0] + \
+            [ship.ship_id for ship in ships if ship.ship_id % 2 == 1]
+        assert accelerations == {ship.ship_id: main._ship_acceleration(ship.position, ship.velocity,
+                                                                       main._remaining_fuel(ship))
+                                 for ship in ships}
+
+    def test_empty_stats(self, planning_pool):
+        planner_stats = {}
+        main._plan_commands(fleets.fleet_game_state(main.PLANNING_POOL_MIN_SHIPS), 'attacker', fleets.FIRST_SHIP_ID, main._make_rng(), 0,
+                            planner_stats=planner_stats, planning_pool=planning_pool)
+        assert planner_stats['n_nodes'] > 0
+
+    def test_dead_worker_falls_back_and_restarts(self):
+        game_state = fleets.fleet_game_state(main.PLANNING_POOL_MIN_SHIPS)
+        ships = [ship_and_command.ship for ship_and_command in game_state.ships_and_commands][1:-1]
+        with main._PlanningPool(2) as pool:
+            with pytest.raises(cf.BrokenExecutor):
+                pool._executors[0].submit(os._exit, 1).result()
+            accelerations = pool.accelerations(ships)
+            assert sorted(accelerations) == [ship.ship_id for ship in ships if ship.ship_id % 2 == 1]
+            fallback_ship_ids = []
+            main._plan_commands(game_state, 'attacker', fleets.FIRST_SHIP_ID, main._make_rng(), 0,
+                                deadline=time.perf_counter() + 10, fallback_ship_ids=fallback_ship_ids,
+                                planning_pool=pool)
+            assert fallback_ship_ids == []
+
+    def test_slow_worker_times_out(self):
+        ships = [ship_and_command.ship for ship_and_command in fleets.fleet_game_state(10).ships_and_commands][1:-1]
+        with main._PlanningPool(2) as pool:
+            pool._executors[0].submit(time.sleep, 1)
+            start = time.perf_counter()
+            accelerations = pool.accelerations(ships, deadline=start + 0.1)
+            assert time.perf_counter() - start < 0.5
+            assert sorted(accelerations) == [ship.ship_id for ship in ships if ship.ship_id % 2 == 1]
+
+    def test_main_closes_pool_and_recording_on_error(self, monkeypatch, tmp_path):
+        opened = {}
+
+        def open_planning_pool(orbit_table=None):
+            opened['pool'] = main._PlanningPool(1)
+            return opened['pool']
+
+        def play_game(player_key, sender_f, profiler, **kwargs):
+            opened['play_game_kwargs'] = kwargs
+            raise ConnectionError('server went away')
+
+        record_path = tmp_path / '{player_key}.rec'
+        monkeypatch.setenv('BOT_RECORD_PATH', str(record_path))
+        monkeypatch.setenv('BOT_ORBIT_TABLE', str(tmp_path / 'missing.bin'))
+        monkeypatch.setenv('BOT_TICK_BUDGET_SECONDS', '0.3')
+        monkeypatch.setattr(main, '_open_planning_pool', open_planning_pool)
+        monkeypatch.setattr(main, '_play_game', play_game)
+        monkeypatch.setattr(main.sys, 'argv', ['main.py', 'http://127.0.0.1:1', '123'])
+        with pytest.raises(ConnectionError):
+            main.main()
+        with pytest.raises(RuntimeError):
+            opened['pool'].accelerations([_test_ship('attacker', 0, (20, 20))])
+        assert (tmp_path / '123.rec').exists()
+        assert opened['play_game_kwargs']['planning_budget'] == 0.3
+
+    def test_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv('BOT_PLANNING_WORKERS', raising=False)
+        assert main._open_planning_pool() is None
+
+
+class TestShipGrid:
+    def _brute_force(self, position, positions):
+        return min(((main._pos_distance(position, other), other) for other in positions),
+                   key=lambda found: found[0], default=(math.inf, None))
+
+    @pytest.mark.parametrize('n_ships', [1, 5, 300])
+    def test_matches_brute_force(self, n_ships):
+        rng = np.random.default_rng(n_ships)
+        positions = [tuple(position) for position in rng.integers(-130, 131, size=(n_ships, 2)).tolist()]
+        grid = main._ShipGrid(positions)
+        for position in rng.integers(-140, 141, size=(200, 2)).tolist():
+            distance, closest = grid.closest(position)
+            assert distance == self._brute_force(position, positions)[0]
+            assert main._pos_distance(position, closest) == distance
+            for radius in (main.MAX_KAMIKAZE_DISTANCE, 40):
+                expected = sorted((main._pos_distance(position, other), other) for other in positions
+                                  if main._pos_distance(position, other) < radius)
+                assert sorted(grid.within(position, radius)) == expected
+
+    def test_empty(self):
+        grid = main._ShipGrid([])
+        assert grid.closest((0, 0)) == (math.inf, None)
+        assert grid.within((0, 0), 100) == []
+
+    def test_kamikaze(self):
+        ships = [_test_ship('attacker', 0, (50, 50), params=(10, 0, 0, 1)),
+                 _test_ship('attacker', 2, (-50, -50), params=(10, 0, 0, 1)),
+                 _test_ship('defender', 1, (60, 55)),
+                 _test_ship('defender', 3, (-50, 70))]
+        cmds, _ = main._plan_commands(_game_state(*ships), 'attacker', 0, main._make_rng(), 0)
+        assert main._detonate_command_template(0) in cmds
+        assert main._detonate_command_template(2) not in cmds
+
+
+class TestSweptPaths:
+    def test_corner(self):
+        # Both positions are outside the planet, but the step between them cuts its corner
+        assert not main._trajectory_hits_planet([[21, 14]])
+        assert main._path_hits_planet([14, 21], [[21, 14]])
+        assert not main._path_hits_planet([16, 22], [[22, 16]])
+        # Touching the corner counts, like a position on the planet's edge does
+        assert main._path_hits_planet([17, 19], [[19, 17]])
+
+    def test_points_still_count(self):
+        assert main._path_hits_planet([30, 30], [[19, 18], [18, 18]])
+        assert not main._path_hits_planet([30, 30], [[30, 30], [31, 30]])
+
+    def test_matches_collision(self):
+        positions, velocities = _random_ships(300, seed=7)
+        for position, velocity in zip(positions, velocities):
+            trajectory = main._predicted_trajectory(position, velocity, n=10)
+            starts = [position] + trajectory[:-1]
+            expected = any(main._point_in_planet(end) or
+                           (start != end and collision.segment_crosses_square(
+                               tuple(start), tuple(end), (0, 0), main.PLANET_SIDE_LENGTH // 2))
+                           for start, end in zip(starts, trajectory))
+            assert main._path_hits_planet(position, trajectory) == expected
+
+    def test_batch_matches_scalar(self):
+        rng = np.random.default_rng(8)
+        positions = rng.integers(-100, 101, size=(2000, 2))
+        velocities = rng.integers(-10, 11, size=(2000, 2))
+        trajectories, point_hits = main._predicted_trajectories(positions, velocities)
+        hits = main._paths_hit_planet_batch(positions, trajectories)
+        assert hits.tolist() == [main._path_hits_planet(position, trajectory)
+                                 for position, trajectory in zip(positions.tolist(), trajectories.tolist())]
+        # Some fast ships only cross the planet between positions
+        assert (hits & ~point_hits).any() and not (point_hits & ~hits).any()
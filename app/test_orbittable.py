@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from app import build_orbit_table
+from app import main
+from app import orbittable
+
+
+RADIUS, MAX_SPEED, HORIZON = 40, 6, 40
+
+
+def _simulated_steps(position, velocity):
+    '''Steps until lost with the table's rules, one step at a time.'''
+    if main._point_in_planet(position):
+        return 0
+    for step in range(1, HORIZON + 1):
+        velocity = main._next_velocity(position, velocity)
+        position = main._next_position(position, velocity)
+        if (main._point_in_planet(position) or max(map(abs, position)) > RADIUS
+                or max(map(abs, velocity)) > MAX_SPEED):
+            return step
+    return orbittable.NO_IMPACT
+
+
+@pytest.fixture(scope='module')
+def table_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('orbits') / 'orbit_table.bin')
+    steps = build_orbit_table.build_table(RADIUS, MAX_SPEED, HORIZON)
+    orbittable.write_table(path, steps, RADIUS, MAX_SPEED, HORIZON)
+    return path
+
+
+@pytest.fixture
+def table(table_path):
+    with orbittable.OrbitTable(table_path) as table:
+        yield table
+
+
+def _random_states(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.integers(-RADIUS - 2, RADIUS + 3, size=(n, 2)).tolist(),
+            rng.integers(-MAX_SPEED - 1, MAX_SPEED + 2, size=(n, 2)).tolist())
+
+
+class TestOrbitTable:
+    def test_header(self, table):
+        assert (table.radius, table.max_speed, table.horizon) == (RADIUS, MAX_SPEED, HORIZON)
+        assert table.steps.shape == orbittable.table_shape(RADIUS, MAX_SPEED)
+
+    def test_matches_simulation(self, table):
+        positions, velocities = _random_states(2000)
+        for position, velocity in zip(positions, velocities):
+            in_table = (max(map(abs, position)) <= RADIUS and max(map(abs, velocity)) <= MAX_SPEED)
+            expected = _simulated_steps(position, velocity) if in_table else None
+            assert table.lookup(position, velocity) == expected
+
+    def test_has_safe_orbits(self, table):
+        assert (table.steps == orbittable.NO_IMPACT).any()
+        assert table.lookup([0, 0], [0, 0]) == 0
+
+    def test_batch_matches_scalar(self, table):
+        positions, velocities = _random_states(500, seed=1)
+        steps, in_table = table.lookup_batch(positions, velocities)
+        for step, found, position, velocity in zip(steps.tolist(), in_table.tolist(), positions, velocities):
+            expected = table.lookup(position, velocity)
+            assert found == (expected is not None)
+            assert step == (orbittable.NO_IMPACT if expected is None else expected)
+
+    def test_bad_files(self, table_path, tmp_path):
+        with open(table_path, 'rb') as f:
+            data = f.read()
+        path = str(tmp_path / 'bad.bin')
+        with open(path, 'wb') as f:
+            f.write(data[:-1])
+        with pytest.raises(ValueError, match='Truncated'):
+            orbittable.OrbitTable(path)
+        with open(path, 'wb') as f:
+            f.write(b'nope' + data)
+        with pytest.raises(ValueError, match='Not an orbit table'):
+            orbittable.OrbitTable(path)
+
+    def test_write_checks_shape(self, tmp_path):
+        with pytest.raises(ValueError):
+            orbittable.write_table(str(tmp_path / 'x.bin'), np.zeros((2, 2, 2, 2)), RADIUS, MAX_SPEED, HORIZON)
+
+
+class TestBot:
+    def test_stable_orbit(self, table):
+        [x, y, vx, vy] = np.argwhere(table.steps == orbittable.NO_IMPACT)[0].tolist()
+        stable = main.Ship('attacker', 0, (x, y), (vx - MAX_SPEED, vy - MAX_SPEED), [10, 0, 0, 2], 0, 64, 1)
+        assert main._ship_has_stable_orbit(stable, table)
+        crashing = main.Ship('attacker', 0, (0, 20), (0, -2), [10, 0, 0, 2], 0, 64, 1)
+        assert not main._ship_has_stable_orbit(crashing, table)
+        # Not in the table: the old heuristic
+        fast = main.Ship('attacker', 0, (0, 20), (10, 0), [10, 0, 0, 2], 0, 64, 1)
+        assert main._ship_has_stable_orbit(fast, table) == main._ship_has_stable_orbit(fast)
+
+    def test_steps_until_lost(self, table):
+        positions, velocities = _random_states(300, seed=2)
+        positions, velocities = np.array(positions), np.array(velocities)
+        steps = main._steps_until_lost(positions, velocities, 10, table)
+        expected = main._steps_until_impact_simulated(positions, velocities, 10, leave_playfield=True)
+        # The small table loses ships at its edge already
+        _, in_table = table.lookup_batch(positions, velocities)
+        assert (steps[~in_table] == expected[~in_table]).all()
+        assert (steps[in_table] <= expected[in_table]).all()
+
+    def test_planner_uses_table(self, table):
+        stats = {}
+        acceleration = main._planned_acceleration([20, 20], [0, 0], max_fuel=10, orbit_table=table, stats=stats)
+        assert acceleration in main.ACCELERATIONS.tolist() + [None]
+        assert stats['n_nodes'] > 0
+
+    def test_planning_pool_opens_table(self, table, table_path):
+        positions, velocities = _random_states(40, seed=3)
+        ships = [main.Ship('attacker', ship_id, position, velocity, [10, 0, 0, 1], 0, 64, 1)
+                 for ship_id, (position, velocity) in enumerate(zip(positions, velocities))]
+        with main._PlanningPool(2, table_path) as pool:
+            accelerations = pool.accelerations(ships)
+        assert accelerations == {ship.ship_id: main._ship_acceleration(ship.position, ship.velocity, 10,
+                                                                       orbit_table=table)
+                                 for ship in ships}
+
+    def test_open_missing_table(self, tmp_path):
+        assert main._open_orbit_table(str(tmp_path / 'missing.bin')) is None
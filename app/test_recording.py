@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from app import main
+from app import recording
+from app import replay
+
+
+RECORDED_GAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'bench_responses', 'simulated_game_attacker.rec')
+
+
+class TestRecording:
+    def test_round_trip(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        exchanges = [('1101000', '110110000101100010'),
+                     ('', '0'),
+                     ('1' * 9, b'01' * 33)]
+        with recording.Recorder(path) as recorder:
+            for request_bits, response_bits in exchanges[:2]:
+                recorder.record(request_bits, response_bits)
+        # Appending to an existing recording
+        with recording.Recorder(path) as recorder:
+            recorder.record(*exchanges[2])
+
+        with recording.Recording(path) as rec:
+            assert [(request, response) for _, request, response in rec] == \
+                [('1101000', '110110000101100010'), ('', '0'), ('1' * 9, '01' * 33)]
+
+    def test_compact(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        with recording.Recorder(path) as recorder:
+            recorder.record('1' * 800, '0' * 8000)
+        assert os.path.getsize(path) < len(recording.MAGIC) + 12 + 8800 // 8 + 1
+
+    def test_cut_off_record_is_ignored(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        with recording.Recorder(path) as recorder:
+            recorder.record('1101000', '1101000')
+            recorder.record('11' * 100, '11' * 100)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+        with recording.Recording(path) as rec:
+            assert [request for _, request, _ in rec] == ['1101000']
+
+    def test_appending_numbers_exchanges_on(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        with recording.Recorder(path) as recorder:
+            recorder.record('1101000', '1101000')
+            recorder.record('11' * 100, '11' * 100)
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+        with recording.Recorder(path) as recorder:
+            assert recorder.n_exchanges == 1
+            recorder.record('0', '1')
+        with recording.Recording(path) as rec:
+            assert [(exchange_i, request) for exchange_i, request, _ in rec] == [(0, '1101000'), (1, '0')]
+
+    def test_close_during_iteration(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        with recording.Recorder(path) as recorder:
+            recorder.record('1101000', '1101000')
+            recorder.record('0', '1')
+        with recording.Recording(path) as rec:
+            it = iter(rec)
+            assert next(it)[0] == 0
+
+    def test_empty(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        recording.Recorder(path).close()
+        with recording.Recording(path) as rec:
+            assert list(rec) == []
+
+    def test_not_a_recording(self, tmp_path):
+        path = tmp_path / 'game.rec'
+        path.write_bytes(b'1101000')
+        with pytest.raises(ValueError):
+            recording.Recording(path)
+
+
+class TestReplay:
+    def test_recorded_responses(self):
+        exchanges = list(replay.recorded_responses(RECORDED_GAME))
+        assert exchanges[0][0][0] == 2
+        assert exchanges[0][1].role == 'attacker'
+        assert exchanges[1][1].game_stage == 'already_started'
+        assert exchanges[-1][1].game_stage == 'finished'
+        assert all(request[0] == 4 for request, _ in exchanges[2:])
+
+    def test_replay(self):
+        profiler = replay.replay(RECORDED_GAME)
+        n_commands = sum(request[0] == 4 for request, _ in replay.recorded_responses(RECORDED_GAME))
+        assert len(profiler.ticks) == n_commands
+        assert profiler.ticks[0]['n_ships'] == 2
+        assert all(tick['network'] == 0 for tick in profiler.ticks)
+
+    def test_replay_is_reproducible(self):
+        commands = []
+
+        def plan_f(*args):
+            cmds, shots_done_count = main._plan_commands(*args)
+            commands.append(cmds)
+            return cmds, shots_done_count
+
+        replay.replay(RECORDED_GAME, plan_f=plan_f, seed=1)
+        first_commands, commands = commands, []
+        replay.replay(RECORDED_GAME, plan_f=plan_f, seed=1)
+        assert commands == first_commands
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+
+import pytest
+
+from app import aio
+from app import main
+from app import simulator
+
+
+def _started_game(attacker_params=(100, 4, 4, 4), defender_params=(100, 4, 4, 4)):
+    game = simulator.Game(seed=7)
+    game.join(0)
+    game.join(1)
+    game.start(0, list(attacker_params))
+    game.start(1, list(defender_params))
+    return game
+
+
+def _step(game, attacker_cmds=(), defender_cmds=()):
+    game.submit_commands(0, list(attacker_cmds))
+    game.submit_commands(1, list(defender_cmds))
+
+
+def _ship(game, ship_id):
+    return next(ship for ship in game.ships if ship.ship_id == ship_id)
+
+
+class TestGame:
+    def test_steps_need_both_players(self):
+        game = simulator.Game(seed=0)
+        game.join(0)
+        assert game.n_steps == 0
+        game.join(1)
+        game.start(0, [100, 0, 0, 1])
+        assert game.game_stage == 0
+        game.start(1, [100, 0, 0, 1])
+        assert (game.game_stage, game.n_steps) == (1, 2)
+        game.submit_commands(1, [])
+        assert game.game_tick == 0
+        game.submit_commands(0, [])
+        assert (game.game_tick, game.n_steps) == (1, 3)
+
+    def test_too_expensive_ship_is_replaced(self):
+        game = _started_game(attacker_params=(512, 1, 0, 1))
+        assert _ship(game, 0).params == [1, 0, 0, 1]
+
+    def test_coasting_follows_predicted_trajectory(self):
+        game = _started_game()
+        ship = _ship(game, 0)
+        expected = main._predicted_trajectory(list(ship.position), list(ship.velocity), n=5)
+        positions = []
+        for _ in range(5):
+            _step(game)
+            if ship not in game.ships:
+                break
+            positions.append(list(ship.position))
+        assert positions == expected[:len(positions)]
+
+    def test_accelerate(self):
+        game = _started_game()
+        ship = _ship(game, 0)
+        position, velocity = ship.position, ship.velocity
+        _step(game, [[0, 0, main.Cons(1, -1)]])
+        expected_velocity = main._next_velocity(position, [velocity[0] - 1, velocity[1] + 1])
+        assert list(ship.velocity) == expected_velocity
+        assert ship.params[0] == 99
+        assert ship.heat == simulator.ACCELERATION_HEAT - 4
+        assert ship.applied_commands == [[0, main.Cons(1, -1)]]
+
+    def test_fork(self):
+        game = _started_game()
+        _step(game, [[3, 0, [10, 0, 0, 1]]])
+        parent, child = _ship(game, 0), _ship(game, 2)
+        assert parent.params == [90, 4, 4, 3]
+        assert child.params == [10, 0, 0, 1]
+        assert (child.role, child.position, child.velocity) == (0, parent.position, parent.velocity)
+
+    def test_fork_needs_two_bombs(self):
+        game = _started_game(attacker_params=(100, 4, 4, 1))
+        _step(game, [[3, 0, [10, 0, 0, 1]]])
+        assert len(game.ships) == 2
+
+    def test_detonation_destroys_nearby_ships(self):
+        game = _started_game()
+        attacker, defender = _ship(game, 0), _ship(game, 1)
+        defender.position = (attacker.position[0] + simulator.DETONATION_RADIUS, attacker.position[1])
+        _step(game, [[1, 0]])
+        assert game.ships == []
+        assert game.game_stage == 2
+
+    def test_shot_heats_up_target(self):
+        game = _started_game()
+        defender = _ship(game, 1)
+        target = main._predicted_trajectory(list(defender.position), list(defender.velocity), n=1)[0]
+        _step(game, [[2, 0, main.Cons(*target), 3]])
+        attacker = _ship(game, 0)
+        assert attacker.applied_commands == [[2, main.Cons(*target), 3, 3, 4]]
+        # Shooter and target both cooled down by 4 coolant
+        assert (attacker.heat, defender.heat) == (0, 0)
+
+    def test_overheating_drains_params(self):
+        game = _started_game(defender_params=(100, 0, 0, 1))
+        _ship(game, 1).heat = simulator.MAX_HEAT + 10
+        _step(game)
+        assert _ship(game, 1).params == [90, 0, 0, 1]
+
+    def test_crashing_into_planet(self):
+        game = _started_game()
+        ship = _ship(game, 0)
+        ship.position = (0, main.PLANET_SIDE_LENGTH // 2 + 2)
+        ship.velocity = (0, -2)
+        _step(game)
+        assert ship not in game.ships
+        assert game.game_stage == 2
+        assert game.response(1)[1] == 2
+
+    def test_game_ends_after_max_n_ticks(self):
+        game = simulator.Game(seed=0, max_n_ticks=3)
+        for role in (0, 1):
+            game.join(role)
+        for role in (0, 1):
+            game.start(role, [100, 0, 0, 1])
+        # Keep both ships in place, far from the planet
+        for ship in game.ships:
+            ship.position = (100, 0)
+        for _ in range(3):
+            for ship in game.ships:
+                ship.velocity = (1, 0)
+            _step(game)
+        assert (game.game_tick, game.game_stage) == (3, 2)
+
+    def test_response_parses(self):
+        game = _started_game()
+        _step(game, [[3, 0, [10, 0, 0, 1]]])
+        resp = main.decode_game_response(main.make_request_body(game.response(0)))
+        assert resp.role == 'attacker'
+        assert resp.game_stage == 'already_started'
+        assert resp.game_state.game_tick == 1
+        assert [sh_cmd.ship.ship_id for sh_cmd in resp.game_state.ships_and_commands] == [0, 1, 2]
+        assert resp.game_state.ships_and_commands[0].applied_commands == [main.Command('fork', [[10, 0, 0, 1]])]
+
+
+class TestPlayLocalGame:
+    def test_deterministic(self):
+        responses_a, stats_a = simulator.play_local_game(seed=3)
+        responses_b, stats_b = simulator.play_local_game(seed=3)
+        assert responses_a == responses_b
+        assert stats_a['n_ticks'] == stats_b['n_ticks'] > 0
+        assert stats_a['n_ships_left'] == stats_b['n_ships_left']
+
+    def test_plays_until_finished(self):
+        responses, stats = simulator.play_local_game(seed=1, max_n_ticks=20)
+        assert [resp.role for resp in responses] == ['attacker', 'defender']
+        assert all(resp.game_stage == 'finished' for resp in responses)
+        assert 0 < stats['n_ticks'] <= 20
+        assert stats['ticks_per_second'] > 0
+
+
+def _play_blocking(player_key, sender_f, results):
+    resp = simulator.play_side(player_key, sender_f)
+    results[resp.role] = resp
+
+
+class TestSimulator:
+    def test_send_in_process(self):
+        sim = simulator.Simulator(seed=0, max_n_ticks=10, player_timeout=5)
+        attacker_key, defender_key = main.send_create(sender_f=sim.send)
+        results = {}
+        thread = threading.Thread(target=_play_blocking, args=(attacker_key, sim.send, results))
+        thread.start()
+        _play_blocking(defender_key, sim.send, results)
+        thread.join()
+        assert results['attacker'].game_state == results['defender'].game_state
+        assert results['attacker'].game_stage == 'finished'
+
+    def test_unknown_player(self):
+        sim = simulator.Simulator()
+        assert sim.handle([2, 12345, None]) == [0]
+        assert sim.handle([0]) == [0]
+
+
+@pytest.fixture
+def simulator_url():
+    server = simulator.make_server(simulator.Simulator(seed=0, max_n_ticks=30, player_timeout=5))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestHTTP:
+    def test_blocking_clients(self, simulator_url):
+        with main.Transport(simulator_url) as attacker_transport, \
+                main.Transport(simulator_url) as defender_transport:
+            attacker_key, defender_key = main.send_create(
+                sender_f=lambda dsl, **kwargs: main.send_dsl(dsl, simulator_url, transport=attacker_transport, **kwargs))
+            results = {}
+            thread = threading.Thread(target=_play_blocking, args=(
+                attacker_key,
+                lambda dsl, **kwargs: main.send_dsl(dsl, simulator_url, transport=attacker_transport, **kwargs),
+                results))
+            thread.start()
+            _play_blocking(defender_key,
+                           lambda dsl, **kwargs: main.send_dsl(dsl, simulator_url, transport=defender_transport, **kwargs),
+                           results)
+            thread.join()
+        assert results['attacker'].game_stage == results['defender'].game_stage == 'finished'
+
+    def test_async_clients(self, simulator_url):
+        results = asyncio.run(aio.play_many_games(simulator_url, 8))
+        for attacker_resp, defender_resp in results:
+            assert attacker_resp.game_stage == defender_resp.game_stage == 'finished'
+            assert attacker_resp.game_state == defender_resp.game_state
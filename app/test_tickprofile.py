@@ -0,0 +1,46 @@
+import pytest
+
+from app import tickprofile
+
+
+class TestTickProfiler:
+    def test_end_tick(self):
+        ticks = []
+        profiler = tickprofile.TickProfiler(on_tick=ticks.append)
+        profiler.add('encode', 0.001)
+        profiler.add('encode', 0.002)
+        profiler.add('network', 0.01)
+        profiler.add('response_bits', 100)
+        with profiler.phase('plan'):
+            pass
+        tick = profiler.end_tick(n_ships=3)
+
+        assert ticks == [tick]
+        assert tick['encode'] == pytest.approx(0.003)
+        assert tick['decode'] == tick['parse'] == 0.0
+        assert tick['total'] == pytest.approx(0.013 + tick['plan'])
+        assert (tick['n_ships'], tick['response_bits']) == (3, 100)
+
+    def test_discard_tick(self):
+        profiler = tickprofile.TickProfiler()
+        profiler.add('network', 1.0)
+        profiler.discard_tick()
+        assert profiler.end_tick()['network'] == 0.0
+
+    def test_summary(self):
+        profiler = tickprofile.TickProfiler()
+        assert profiler.summary() == {'n_ticks': 0}
+        for i in range(1, 101):
+            profiler.add('plan', i / 1000)
+            profiler.add('response_bits', 10 * i)
+            profiler.end_tick(n_ships=i % 4)
+
+        summary = profiler.summary()
+        assert summary['n_ticks'] == 100
+        assert summary['plan']['p50'] == pytest.approx(50.5)
+        assert summary['plan']['p99'] == pytest.approx(99.01)
+        assert summary['plan']['max'] == pytest.approx(100)
+        assert summary['total'] == summary['plan']
+        assert summary['encode']['p95'] == 0
+        assert summary['response_bits']['max'] == 1000
+        assert summary['n_ships']['max'] == 3
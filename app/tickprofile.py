@@ -0,0 +1,86 @@
+'''Where the time of a tick goes. `main.send_dsl` and `main.send_commands`
+take a `TickProfiler` and add the time they spend in each phase:
+
+    encode   building the request body (`make_request_body` and the command templates)
+    network  the HTTP round trip until the response headers arrive
+    decode   reading the response body after the headers and decoding it
+             (`decode_game_response` or `parse_response_body`)
+    parse    turning the decoded response into records (`_parse_game_response`)
+    plan     the strategy, timed by the caller
+
+`aio.send_dsl` gets the whole body from its transport at once, so there the
+body is part of network instead.
+
+`end_tick` closes a tick, together with the number of ships and the request
+and response sizes, and passes the tick's record to `on_tick` if given.
+`summary` has percentiles of each over all the ticks so far.
+'''
+import contextlib
+import time
+import typing as t
+
+import numpy as np
+
+
+PHASES = ('encode', 'network', 'decode', 'parse', 'plan')
+PERCENTILES = (50, 95, 99)
+
+
+class TickProfiler:
+    def __init__(self, on_tick: t.Callable[[dict], None] = None):
+        self.on_tick = on_tick
+        self.ticks = []
+        self._current = {}
+
+    def add(self, name, value):
+        '''Adds `value` to this tick's `name`: seconds for the phases, or
+        anything else to track per tick, e.g. `response_bits`.
+        '''
+        self._current[name] = self._current.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def discard_tick(self):
+        '''Forgets what was added since the last `end_tick`, e.g. for joining and starting.'''
+        self._current = {}
+
+    def end_tick(self, n_ships=None) -> dict:
+        tick = {phase: 0.0 for phase in PHASES}
+        tick.update(self._current)
+        tick['total'] = sum(tick[phase] for phase in PHASES)
+        tick['n_ships'] = n_ships
+        self._current = {}
+        self.ticks.append(tick)
+        if self.on_tick is not None:
+            self.on_tick(tick)
+        return tick
+
+    def summary(self) -> dict:
+        '''`{name: {'p50': ..., 'p95': ..., 'p99': ..., 'max': ..., 'mean': ...}}` over the ticks,
+        for every phase, `total`, `n_ships` and the body sizes. Times are in milliseconds.
+        '''
+        summary = {'n_ticks': len(self.ticks)}
+        if not self.ticks:
+            return summary
+
+        names = list(PHASES) + ['total'] + sorted({name for tick in self.ticks for name in tick}
+                                                  - set(PHASES) - {'total'})
+        for name in names:
+            values = np.array([tick[name] for tick in self.ticks
+                               if tick.get(name) is not None], dtype=float)
+            if len(values) == 0:
+                continue
+            if name in PHASES or name == 'total':
+                values = values * 1e3
+            stats = {f'p{p}': round(float(v), 3)
+                     for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+            stats['max'] = round(float(values.max()), 3)
+            stats['mean'] = round(float(values.mean()), 3)
+            summary[name] = stats
+        return summary
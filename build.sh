@@ -1,3 +1,4 @@
 #!/bin/sh
 
 pip install -r requirements.txt
+python app/build_orbit_table.py app/orbit_table.bin